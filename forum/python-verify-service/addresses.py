@@ -0,0 +1,65 @@
+import re
+import unicodedata
+
+# Canonical forms for street types and directions, English and French
+STREET_ABBREVIATIONS = {
+    'STREET': 'ST', 'STR': 'ST',
+    'AVENUE': 'AVE', 'AV': 'AVE',
+    'BOULEVARD': 'BLVD', 'BOUL': 'BLVD', 'BD': 'BLVD',
+    'ROAD': 'RD',
+    'DRIVE': 'DR',
+    'CHEMIN': 'CH',
+    'PLACE': 'PL',
+    'CRESCENT': 'CRES',
+    'COURT': 'CRT', 'CT': 'CRT',
+    'LANE': 'LN',
+    'TERRACE': 'TERR',
+    'PARKWAY': 'PKY',
+    'HIGHWAY': 'HWY',
+    'AUTOROUTE': 'AUT',
+    'MONTEE': 'MTEE',
+    'RANG': 'RG',
+    'SAINT': 'ST', 'SAINTE': 'STE',
+    'APARTMENT': 'APT', 'APPARTEMENT': 'APP',
+    'SUITE': 'SUITE', 'BUREAU': 'BUR',
+    'NORTH': 'N', 'NORD': 'N',
+    'SOUTH': 'S', 'SUD': 'S',
+    'EAST': 'E', 'EST': 'E',
+    # Canada Post abbreviates Ouest as O; it shares W with West so both spellings match
+    'WEST': 'W', 'OUEST': 'W', 'O': 'W',
+}
+
+POSTAL_CODE_PATTERN = re.compile(r'\b([A-Z]\d[A-Z])\s*-?\s*(\d[A-Z]\d)\b')
+
+
+def strip_accents(text):
+    """Remove combining accents, e.g. 'Montréal' -> 'Montreal'."""
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def normalize_postal_code(postal_code):
+    """Canonicalize a Canadian postal code to 'A1A 1A1', or return None if it is not one."""
+    if not postal_code:
+        return None
+    match = POSTAL_CODE_PATTERN.search(strip_accents(postal_code).upper())
+    return f"{match.group(1)} {match.group(2)}" if match else None
+
+
+def normalize_address(address):
+    """Canonicalize an address string so equivalent spellings share one cache key.
+
+    Uppercases, strips accents and punctuation, abbreviates street types and
+    directions, and formats postal codes as 'A1A 1A1'.
+    """
+    text = strip_accents(address).upper()
+    text = POSTAL_CODE_PATTERN.sub(r'\1 \2', text)
+    text = re.sub(r"[.#'’]", '', text)
+    text = text.replace('-', ' ')
+
+    parts = []
+    for part in text.split(','):
+        tokens = [STREET_ABBREVIATIONS.get(token, token) for token in part.split()]
+        if tokens:
+            parts.append(' '.join(tokens))
+    return ', '.join(parts)
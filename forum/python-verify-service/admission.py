@@ -0,0 +1,78 @@
+import math
+import threading
+
+
+class AdmissionController:
+    """Admit work while in-flight count and reserved memory stay within budget.
+
+    Requests that do not fit are meant to be rejected immediately (429) rather
+    than queued. retry_after() estimates when a slot frees up from an EWMA of
+    recent request durations. Background work instead waits in admit_below()
+    for a lower in-flight limit, so it only uses capacity live requests leave free.
+    """
+
+    def __init__(self, max_in_flight, memory_budget_bytes, initial_duration=5.0, smoothing=0.2,
+                 min_retry_after=1, max_retry_after=60):
+        self.max_in_flight = max_in_flight
+        self.memory_budget_bytes = memory_budget_bytes
+        self.smoothing = smoothing
+        self.min_retry_after = min_retry_after
+        self.max_retry_after = max_retry_after
+        self._avg_duration = initial_duration
+        self._in_flight = 0
+        self._reserved_bytes = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+
+    def _fits(self, cost_bytes, max_in_flight):
+        # A request larger than the whole budget is still admitted when idle
+        over_memory = self._in_flight and self._reserved_bytes + cost_bytes > self.memory_budget_bytes
+        return self._in_flight < max_in_flight and not over_memory
+
+    def _reserve(self, cost_bytes):
+        self._in_flight += 1
+        self._reserved_bytes += cost_bytes
+        self._admitted += 1
+
+    def try_admit(self, cost_bytes):
+        """Reserve a slot and cost_bytes of memory. Returns False when over budget."""
+        with self._lock:
+            if not self._fits(cost_bytes, self.max_in_flight):
+                self._rejected += 1
+                return False
+            self._reserve(cost_bytes)
+            return True
+
+    def admit_below(self, cost_bytes, max_in_flight):
+        """Wait until fewer than max_in_flight requests run and cost_bytes fits, then reserve a slot."""
+        with self._released:
+            while not self._fits(cost_bytes, min(max_in_flight, self.max_in_flight)):
+                self._released.wait()
+            self._reserve(cost_bytes)
+
+    def release(self, cost_bytes, duration):
+        with self._released:
+            self._in_flight -= 1
+            self._reserved_bytes -= cost_bytes
+            self._avg_duration += self.smoothing * (duration - self._avg_duration)
+            self._released.notify_all()
+
+    def retry_after(self):
+        """Seconds until a slot is expected to free up, assuming in-flight requests finish evenly spread."""
+        with self._lock:
+            expected = self._avg_duration / max(1, self._in_flight)
+        return min(self.max_retry_after, max(self.min_retry_after, math.ceil(expected)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': self._in_flight,
+                'max_in_flight': self.max_in_flight,
+                'reserved_bytes': self._reserved_bytes,
+                'memory_budget_bytes': self.memory_budget_bytes,
+                'avg_duration_ms': round(self._avg_duration * 1000, 1),
+                'admitted': self._admitted,
+                'rejected': self._rejected,
+            }
@@ -1,17 +1,46 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-import face_recognition
-import numpy as np
-from PIL import Image
+import httpx
 import requests
-from io import BytesIO
+from requests.adapters import HTTPAdapter
+import copy
+import hashlib
 import logging
+import math
 import os
-import gc
-import base64
+import hmac
 import json
+import time
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from geocodio import Geocodio
-from openai import OpenAI
+import openai
+from openai import OpenAI, NOT_GIVEN
+from urllib.parse import urlparse
+import faces
+from addresses import normalize_address
+from postal_index import PostalIndex
+from districts import DistrictIndex
+from quality import assess_image, quality_failure
+from images import ImageSource
+from id_payload import ID_PAYLOAD_PROFILES, prepare_id_payload
+from cache import LRUCache, SQLiteCache, TieredCache, cache_key
+from face_pool import FacePool
+from face_index import FaceIndex
+from image_hash import ImageHashIndex, phash
+from jobs import JobQueue, MemoryJobStore, SQLiteJobStore, QueueFullError
+from deadline import Deadline, DeadlineExceeded, wait_for
+from hedging import Hedger, HedgeCancelled
+from breakers import CircuitBreaker, Bulkhead, BulkheadFullError, guarded_call
+from admission import AdmissionController
+from ratelimit import RateLimiter
+from procstats import memory_usage
+from memory_monitor import MemoryMonitor
+from warmup import WorkerStartup, synthetic_image
+from metrics import (
+    STAGE_SECONDS, DOWNLOAD_BYTES, IMAGE_LONGEST_SIDE, UPSTREAM_ERRORS, IN_FLIGHT, FACE_MATCH_SCORE,
+    WORKER_START_SECONDS, WORKER_MEMORY_BYTES, render as render_metrics
+)
 
 app = Flask(__name__)
 CORS(app)
@@ -21,8 +50,23 @@ app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024  # 32MB max request size
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# With VERIFY_PRELOAD, gunicorn imports this module once in the master (see gunicorn.conf.py)
+# and forks the workers from it, so the models, clients and indexes set up below are shared
+# copy-on-write instead of being loaded again by every new or recycled worker. Module-level
+# setup must therefore not start threads or open connections.
+VERIFY_PRELOAD = os.environ.get('VERIFY_PRELOAD', 'false').lower() in ('1', 'true', 'yes')
+
+# Time budget for one verification, overridable per request with the
+# X-Verify-Deadline-Ms header and clamped below the gunicorn worker timeout.
+# Downloads, the OpenAI call and Geocodio each get whatever time is left, and a
+# Geocodio call at most GEOCODIO_TIMEOUT_SECONDS (never more than the default budget).
+VERIFY_DEADLINE_SECONDS = float(os.environ.get('VERIFY_DEADLINE_SECONDS', 60))
+VERIFY_DEADLINE_MAX_SECONDS = float(os.environ.get('VERIFY_DEADLINE_MAX_SECONDS', 170))
+DOWNLOAD_TIMEOUT_SECONDS = 15
+GEOCODIO_TIMEOUT_SECONDS = min(float(os.environ.get('GEOCODIO_TIMEOUT_SECONDS', 5)), VERIFY_DEADLINE_SECONDS)
+
 GEOCODIO_API_KEY = os.environ.get('GEOCODIO_API_KEY')
-geocodio_client = Geocodio(GEOCODIO_API_KEY) if GEOCODIO_API_KEY else None
+geocodio_client = Geocodio(GEOCODIO_API_KEY, single_timeout=GEOCODIO_TIMEOUT_SECONDS) if GEOCODIO_API_KEY else None
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
 openai_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
 
@@ -30,174 +74,660 @@ openai_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
 logger.info(f"Geocodio configured: {geocodio_client is not None}")
 logger.info(f"OpenAI configured: {openai_client is not None}")
 
+OPENAI_VISION_MODEL = os.environ.get('OPENAI_VISION_MODEL', 'gpt-4o')
+
+# Hedged vision calls: when a call is still running after OPENAI_HEDGE_PERCENTILE of
+# recent latencies, an identical call is raced against it and the loser is closed.
+# OPENAI_HEDGE_MAX_PER_MINUTE caps the extra calls per gunicorn worker. Each of the
+# OPENAI_BULKHEAD_LIMIT concurrent calls can hold a primary and a hedge thread, plus
+# headroom for losers that are still closing, so primaries never queue behind hedges.
+OPENAI_BULKHEAD_LIMIT = int(os.environ.get('OPENAI_BULKHEAD_LIMIT', 6))
+OPENAI_HEDGE_ENABLED = os.environ.get('OPENAI_HEDGE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+openai_hedger = None
+if OPENAI_HEDGE_ENABLED:
+    openai_hedger = Hedger(
+        percentile=float(os.environ.get('OPENAI_HEDGE_PERCENTILE', 95)),
+        min_delay=float(os.environ.get('OPENAI_HEDGE_MIN_DELAY_MS', 1000)) / 1000,
+        per_minute=int(os.environ.get('OPENAI_HEDGE_MAX_PER_MINUTE', 10)),
+        min_samples=int(os.environ.get('OPENAI_HEDGE_MIN_SAMPLES', 20)),
+        max_workers=2 * OPENAI_BULKHEAD_LIMIT + 2
+    )
+logger.info(f"OpenAI request hedging: {OPENAI_HEDGE_ENABLED}")
+
+# Face inference runs in a dedicated process pool when FACE_POOL_PROCESSES > 0, so the
+# dlib models are loaded by the pool processes only and not by every gunicorn worker.
+# FACE_POOL_START_METHOD=forkserver loads them once per worker and shares them with its pool.
+FACE_POOL_PROCESSES = int(os.environ.get('FACE_POOL_PROCESSES', 0))
+FACE_POOL_START_METHOD = os.environ.get('FACE_POOL_START_METHOD', 'spawn').lower()
+if FACE_POOL_PROCESSES > 0:
+    face_pool = FacePool(FACE_POOL_PROCESSES, FACE_POOL_START_METHOD)
+else:
+    faces.load_models()
+    face_pool = None
+logger.info(f"Face inference pool processes: {FACE_POOL_PROCESSES}")
+
+# Minimum face match score for a successful verification
+FACE_MATCH_THRESHOLD = float(os.environ.get('FACE_MATCH_THRESHOLD', 0.4))
+# 'fixed' always encodes with 5 jitters; 'adaptive' encodes with 1 jitter and only
+# escalates to 5 when the score is within FACE_JITTER_BAND of the threshold
+FACE_JITTER_MODE = os.environ.get('FACE_JITTER_MODE', 'fixed').lower()
+FACE_JITTER_BAND = float(os.environ.get('FACE_JITTER_BAND', 0.1))
+
+# Multi-frame selfies (selfie_urls): frame scores against the ID are combined with
+# 'median' or 'best_k' (mean of the SELFIE_FRAME_BEST_K best frames)
+VERIFY_MAX_SELFIE_FRAMES = int(os.environ.get('VERIFY_MAX_SELFIE_FRAMES', 5))
+SELFIE_FRAME_AGGREGATION = os.environ.get('SELFIE_FRAME_AGGREGATION', 'median').lower()
+SELFIE_FRAME_BEST_K = int(os.environ.get('SELFIE_FRAME_BEST_K', 3))
 
-def geocode_address(address):
-    """Geocode an address to lat/lng coordinates."""
+# What to do when face detection already rules out a match: 'skip' skips OCR and
+# geocoding, 'ocr_only' still runs OCR for diagnostics, 'off' always runs every stage
+FAIL_FAST_POLICY = os.environ.get('FAIL_FAST_POLICY', 'skip').lower()
+
+# Image quality gate run on the decoded arrays before encoding and OCR. Sharpness
+# is the Laplacian variance of a <=512px luma copy (of the face, when detected).
+QUALITY_GATE_ENABLED = os.environ.get('QUALITY_GATE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+QUALITY_THRESHOLDS = {
+    'min_sharpness': float(os.environ.get('QUALITY_MIN_SHARPNESS', 40)),
+    'min_brightness': float(os.environ.get('QUALITY_MIN_BRIGHTNESS', 40)),
+    'max_brightness': float(os.environ.get('QUALITY_MAX_BRIGHTNESS', 230)),
+    'max_dark_fraction': float(os.environ.get('QUALITY_MAX_DARK_FRACTION', 0.6)),
+    'max_bright_fraction': float(os.environ.get('QUALITY_MAX_BRIGHT_FRACTION', 0.5)),
+}
+QUALITY_MIN_FACE_FRACTION = float(os.environ.get('QUALITY_MIN_FACE_FRACTION', 0.1))
+
+# Index of verified selfie encodings, searched on every verification to spot one face
+# behind several accounts. Once it holds FACE_INDEX_TRAIN_MIN_ROWS rows, a coarse
+# quantizer with FACE_INDEX_CLUSTERS clusters is trained in the background and only
+# the FACE_INDEX_NPROBE nearest clusters are searched. An empty path disables it.
+FACE_INDEX_PATH = os.environ.get('FACE_INDEX_PATH', '/tmp/verify-face-index')
+FACE_INDEX_MAX_DISTANCE = float(os.environ.get('FACE_INDEX_MAX_DISTANCE', 0.5))
+FACE_INDEX_MAX_MATCHES = int(os.environ.get('FACE_INDEX_MAX_MATCHES', 5))
+FACE_INDEX_CLUSTERS = int(os.environ.get('FACE_INDEX_CLUSTERS', 1024))
+FACE_INDEX_NPROBE = int(os.environ.get('FACE_INDEX_NPROBE', 8))
+FACE_INDEX_TRAIN_MIN_ROWS = int(os.environ.get('FACE_INDEX_TRAIN_MIN_ROWS', 100000))
+face_index = None
+if FACE_INDEX_PATH:
     try:
-        if not address:
-            logger.warning("Geocoding skipped: no address provided")
-            return None
-        if geocodio_client is None:
-            logger.warning("Geocoding skipped: GEOCODIO_API_KEY not configured")
-            return None
-        res = geocodio_client.geocode(address)
-        logger.info(f"Geocodio raw response type: {type(res)}")
-        logger.info(f"Geocodio raw response: {res}")
-        if not res:
-            logger.warning("Geocodio returned empty response")
-            return None
-        
-        # Handle dict response (direct API response)
-        if isinstance(res, dict):
+        face_index = FaceIndex(FACE_INDEX_PATH, nprobe=FACE_INDEX_NPROBE)
+    except Exception as e:
+        logger.error(f"Failed to open face index at {FACE_INDEX_PATH}: {e}")
+logger.info(f"Face index entries: {len(face_index) if face_index is not None else 0}")
+face_index_training = threading.Lock()
+
+# Perceptual hashes of every ID photo, to flag the same ID image (re-compressed,
+# lightly cropped or re-photographed) reused across attempts. Empty path disables.
+ID_HASH_INDEX_PATH = os.environ.get('ID_HASH_INDEX_PATH', '/tmp/verify-id-hashes')
+ID_HASH_MAX_DISTANCE = int(os.environ.get('ID_HASH_MAX_DISTANCE', 6))
+ID_HASH_MAX_MATCHES = int(os.environ.get('ID_HASH_MAX_MATCHES', 5))
+id_hash_index = None
+if ID_HASH_INDEX_PATH:
+    try:
+        id_hash_index = ImageHashIndex(ID_HASH_INDEX_PATH)
+    except Exception as e:
+        logger.error(f"Failed to open ID hash index at {ID_HASH_INDEX_PATH}: {e}")
+logger.info(f"ID hash index entries: {len(id_hash_index) if id_hash_index is not None else 0}")
+
+# Content-addressed cache for face encodings and ID extractions, keyed by the
+# SHA-256 of the downloaded image bytes plus the stage parameters
+STAGE_CACHE_MAX_ENTRIES = int(os.environ.get('STAGE_CACHE_MAX_ENTRIES', 512))
+STAGE_CACHE_TTL = int(os.environ.get('STAGE_CACHE_TTL', 86400))
+STAGE_CACHE_DB_PATH = os.environ.get('STAGE_CACHE_DB_PATH')
+face_cache = TieredCache(
+    'faces',
+    LRUCache(STAGE_CACHE_MAX_ENTRIES, STAGE_CACHE_TTL),
+    SQLiteCache(STAGE_CACHE_DB_PATH, STAGE_CACHE_TTL, table='face_encodings') if STAGE_CACHE_DB_PATH else None
+)
+extraction_cache = TieredCache(
+    'extraction',
+    LRUCache(STAGE_CACHE_MAX_ENTRIES, STAGE_CACHE_TTL),
+    SQLiteCache(STAGE_CACHE_DB_PATH, STAGE_CACHE_TTL, table='id_extractions') if STAGE_CACHE_DB_PATH else None
+)
+
+# Geocoding results keyed by normalized address: in-process LRU plus a SQLite
+# tier shared by all gunicorn workers. Misses are cached with a shorter TTL.
+GEOCODE_CACHE_MAX_ENTRIES = int(os.environ.get('GEOCODE_CACHE_MAX_ENTRIES', 4096))
+GEOCODE_CACHE_TTL = int(os.environ.get('GEOCODE_CACHE_TTL', 30 * 86400))
+GEOCODE_NEGATIVE_TTL = int(os.environ.get('GEOCODE_NEGATIVE_TTL', 3600))
+GEOCODE_CACHE_DB_PATH = os.environ.get('GEOCODE_CACHE_DB_PATH', '/tmp/verify-geocode-cache.sqlite3')
+geocode_cache = TieredCache(
+    'geocode',
+    LRUCache(GEOCODE_CACHE_MAX_ENTRIES, GEOCODE_CACHE_TTL),
+    SQLiteCache(GEOCODE_CACHE_DB_PATH, GEOCODE_CACHE_TTL, table='geocodes') if GEOCODE_CACHE_DB_PATH else None
+)
+
+# Offline postal code centroid index, consulted before Geocodio. Lookups at or above
+# POSTAL_INDEX_MIN_PRECISION ('postal_code' or 'fsa') skip Geocodio entirely;
+# coarser hits are only used when Geocodio finds nothing.
+POSTAL_INDEX_PATH = os.environ.get('POSTAL_INDEX_PATH', 'postal_index.npy')
+POSTAL_INDEX_MIN_PRECISION = os.environ.get('POSTAL_INDEX_MIN_PRECISION', 'postal_code')
+POSTAL_PRECISION_RANK = {'fsa': 1, 'postal_code': 2}
+postal_index = None
+if POSTAL_INDEX_PATH and os.path.exists(POSTAL_INDEX_PATH):
+    try:
+        postal_index = PostalIndex.load(POSTAL_INDEX_PATH)
+    except Exception as e:
+        logger.error(f"Failed to load postal index from {POSTAL_INDEX_PATH}: {e}")
+elif POSTAL_INDEX_PATH:
+    logger.warning(f"Postal index {POSTAL_INDEX_PATH} not found, every address goes to Geocodio")
+logger.info(f"Postal index entries: {len(postal_index) if postal_index is not None else 0}")
+
+# District boundaries for local point-in-polygon lookups, loaded once per process
+# from federal.geojson, provincial.geojson and municipal.geojson in DISTRICTS_DIR
+DISTRICTS_DIR = os.environ.get('DISTRICTS_DIR', 'districts')
+DISTRICTS_BATCH_MAX_POINTS = int(os.environ.get('DISTRICTS_BATCH_MAX_POINTS', 10000))
+district_index = None
+if DISTRICTS_DIR and os.path.isdir(DISTRICTS_DIR):
+    try:
+        district_index = DistrictIndex.load(DISTRICTS_DIR)
+    except Exception as e:
+        logger.error(f"Failed to load district boundaries from {DISTRICTS_DIR}: {e}")
+elif DISTRICTS_DIR:
+    logger.warning(f"District directory {DISTRICTS_DIR} not found, /verify returns no districts")
+logger.info(f"District boundaries loaded: {district_index.sizes() if district_index else {}}")
+
+# Thread pool for the network-bound download, OCR and geocoding stages of each request
+VERIFY_STAGE_THREADS = int(os.environ.get('VERIFY_STAGE_THREADS', 16))
+stage_executor = ThreadPoolExecutor(max_workers=VERIFY_STAGE_THREADS, thread_name_prefix='verify-stage')
+
+# Circuit breakers per upstream dependency, per gunicorn worker. A breaker opens when
+# BREAKER_FAILURE_RATE of its last BREAKER_WINDOW calls failed or were slower than the
+# dependency's slow-call limit, and lets a probe through after BREAKER_OPEN_SECONDS.
+BREAKER_FAILURE_RATE = float(os.environ.get('BREAKER_FAILURE_RATE', 0.5))
+BREAKER_MIN_CALLS = int(os.environ.get('BREAKER_MIN_CALLS', 10))
+BREAKER_WINDOW = int(os.environ.get('BREAKER_WINDOW', 20))
+BREAKER_OPEN_SECONDS = float(os.environ.get('BREAKER_OPEN_SECONDS', 30))
+
+
+def create_breaker(name, slow_call_seconds, ignore=None, timeouts=()):
+    return CircuitBreaker(
+        name, BREAKER_FAILURE_RATE, slow_call_seconds, BREAKER_MIN_CALLS, BREAKER_WINDOW, BREAKER_OPEN_SECONDS,
+        ignore=ignore, timeouts=timeouts, on_failure=lambda kind: UPSTREAM_ERRORS.labels(name, kind).inc()
+    )
+
+
+def is_storage_client_error(exc):
+    """Oversized images and 4xx responses (missing object, expired signed URL) are not storage outages."""
+    if isinstance(exc, ValueError) and not isinstance(exc, requests.RequestException):
+        return True
+    response = getattr(exc, 'response', None) if isinstance(exc, requests.HTTPError) else None
+    return response is not None and 400 <= response.status_code < 500 and response.status_code not in (408, 429)
+
+
+breakers = {
+    'openai': create_breaker(
+        'openai', float(os.environ.get('OPENAI_SLOW_CALL_SECONDS', 30)),
+        ignore=lambda exc: isinstance(exc, openai.BadRequestError), timeouts=(openai.APITimeoutError, TimeoutError)
+    ),
+    'geocodio': create_breaker(
+        'geocodio', float(os.environ.get('GEOCODIO_SLOW_CALL_SECONDS', 5)), timeouts=(httpx.TimeoutException,)
+    ),
+    'storage': create_breaker(
+        'storage', float(os.environ.get('STORAGE_SLOW_CALL_SECONDS', 10)),
+        ignore=is_storage_client_error, timeouts=(requests.Timeout,)
+    ),
+}
+
+# Concurrency limits per stage, so one slow upstream or a burst of face work cannot
+# take every gthread. Network stages wait at most BULKHEAD_WAIT_SECONDS for a slot,
+# the face stage at most FACE_BULKHEAD_WAIT_SECONDS.
+BULKHEAD_WAIT_SECONDS = float(os.environ.get('BULKHEAD_WAIT_SECONDS', 2))
+FACE_BULKHEAD_WAIT_SECONDS = float(os.environ.get('FACE_BULKHEAD_WAIT_SECONDS', 10))
+bulkheads = {
+    'face': Bulkhead('face', int(os.environ.get('FACE_BULKHEAD_LIMIT', 4))),
+    'openai': Bulkhead('openai', OPENAI_BULKHEAD_LIMIT),
+    'geocodio': Bulkhead('geocodio', int(os.environ.get('GEOCODIO_BULKHEAD_LIMIT', 4))),
+    'storage': Bulkhead('storage', int(os.environ.get('STORAGE_BULKHEAD_LIMIT', 8))),
+}
+
+
+def bulkhead_wait(deadline, limit=BULKHEAD_WAIT_SECONDS):
+    """Seconds to wait for a bulkhead slot: the limit, or less when the deadline is closer."""
+    return min(limit, deadline.remaining()) if deadline is not None else limit
+
+# Admission control for /verify: beyond ADMISSION_MAX_IN_FLIGHT requests or
+# ADMISSION_MEMORY_BUDGET_MB of decoded images per gunicorn worker, requests are
+# rejected with 429 instead of queueing until the gunicorn timeout. Each request
+# reserves one decoded 2048px RGB image (about 12MB) per selfie frame and ID photo.
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', 6))
+ADMISSION_MEMORY_BUDGET_MB = int(os.environ.get('ADMISSION_MEMORY_BUDGET_MB', 150))
+DECODED_IMAGE_BYTES = 2048 * 2048 * 3
+admission = AdmissionController(ADMISSION_MAX_IN_FLIGHT, ADMISSION_MEMORY_BUDGET_MB * 1024 * 1024)
+
+# Memory-growth instrumentation per gunicorn worker (see memory_monitor.py): the RSS delta
+# of every verification, and with MEMORY_TRACEMALLOC_FRAMES > 0 tracemalloc diffs by
+# allocation site. Reports are served on /admin/memory, which is disabled unless
+# ADMIN_TOKEN is set, and, when MEMORY_REPORT_PATH is set, appended to that file every
+# MEMORY_REPORT_INTERVAL_SECONDS, rotating it past MEMORY_REPORT_MAX_BYTES.
+MEMORY_REPORT_PATH = os.environ.get('MEMORY_REPORT_PATH', '')
+MEMORY_REPORT_MAX_BYTES = int(os.environ.get('MEMORY_REPORT_MAX_BYTES', 10 * 1024 * 1024))
+MEMORY_REPORT_INTERVAL_SECONDS = int(os.environ.get('MEMORY_REPORT_INTERVAL_SECONDS', 300))
+MEMORY_TRACEMALLOC_FRAMES = int(os.environ.get('MEMORY_TRACEMALLOC_FRAMES', 0))
+MEMORY_TOP_SITES = int(os.environ.get('MEMORY_TOP_SITES', 15))
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+memory_monitor = MemoryMonitor(
+    MEMORY_REPORT_PATH, MEMORY_REPORT_INTERVAL_SECONDS, MEMORY_TRACEMALLOC_FRAMES, MEMORY_TOP_SITES,
+    report_max_bytes=MEMORY_REPORT_MAX_BYTES
+)
+
+# Image downloads share one keep-alive connection pool to Supabase storage
+MAX_IMAGE_BYTES = int(os.environ.get('MAX_IMAGE_BYTES', 20 * 1024 * 1024))
+http_session = requests.Session()
+http_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=VERIFY_STAGE_THREADS)
+http_session.mount('https://', http_adapter)
+http_session.mount('http://', http_adapter)
+
+# Asynchronous /verify/jobs configuration
+VERIFY_JOB_BACKEND = os.environ.get('VERIFY_JOB_BACKEND', 'sqlite').lower()
+VERIFY_JOB_DB_PATH = os.environ.get('VERIFY_JOB_DB_PATH', '/tmp/verify-jobs.sqlite3')
+VERIFY_JOB_WORKERS = int(os.environ.get('VERIFY_JOB_WORKERS', 2))
+# Off for processes that only import the pipeline (verify_batch.py), so they never
+# claim /verify/jobs jobs from the shared store and abandon them on exit
+VERIFY_JOB_WORKERS_ENABLED = os.environ.get('VERIFY_JOB_WORKERS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+VERIFY_JOB_MAX_PENDING = int(os.environ.get('VERIFY_JOB_MAX_PENDING', 64))
+# Jobs hold payloads and results with personal data: past VERIFY_JOB_TTL they are no
+# longer served, and every VERIFY_JOB_PURGE_SECONDS they are deleted from the store
+VERIFY_JOB_TTL = int(os.environ.get('VERIFY_JOB_TTL', 3600))
+VERIFY_JOB_PURGE_SECONDS = float(os.environ.get('VERIFY_JOB_PURGE_SECONDS', 60))
+# Jobs are claimed from the store under a lease; a job still running when its lease runs
+# out (its gunicorn worker exited) is claimed again, up to VERIFY_JOB_MAX_ATTEMPTS times
+VERIFY_JOB_LEASE_SECONDS = float(os.environ.get('VERIFY_JOB_LEASE_SECONDS', 300))
+VERIFY_JOB_MAX_ATTEMPTS = int(os.environ.get('VERIFY_JOB_MAX_ATTEMPTS', 2))
+# callback_url is only accepted for hosts in VERIFY_CALLBACK_ALLOWED_HOSTS, and callbacks
+# are signed with VERIFY_CALLBACK_SECRET; without both, callbacks are rejected
+VERIFY_CALLBACK_ALLOWED_HOSTS = [
+    host.strip().lower() for host in os.environ.get('VERIFY_CALLBACK_ALLOWED_HOSTS', '').split(',') if host.strip()
+]
+VERIFY_CALLBACK_SECRET = os.environ.get('VERIFY_CALLBACK_SECRET')
+
+# Bulk re-processing via /verify/batch and verify_batch.py. Images for up to
+# BATCH_PREFETCH upcoming items are downloaded while BATCH_CONCURRENCY items are
+# verified, and items start no faster than BATCH_OPENAI_PER_MINUTE (0 = unlimited).
+# Batch items also go through admission control, but wait for a slot and only start
+# while fewer than BATCH_ADMISSION_MAX_IN_FLIGHT verifications run in the worker, so
+# live /verify requests keep the remaining slots, face bulkhead and stage threads.
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 4))
+BATCH_ADMISSION_MAX_IN_FLIGHT = int(
+    os.environ.get('BATCH_ADMISSION_MAX_IN_FLIGHT', max(1, ADMISSION_MAX_IN_FLIGHT // 2))
+)
+BATCH_PREFETCH = int(os.environ.get('BATCH_PREFETCH', 4))
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 5000))
+BATCH_OPENAI_PER_MINUTE = int(os.environ.get('BATCH_OPENAI_PER_MINUTE', 300))
+# One budget for all batches in the worker, so concurrent batches do not each get their own
+batch_limiter = RateLimiter(BATCH_OPENAI_PER_MINUTE)
+
+
+def lookup_geocodio(address, deadline=None):
+    """Geocode an address with Geocodio. Returns {'lat', 'lng'} or None when nothing was found.
+
+    With a deadline the call is given at most the time left. The client only takes
+    a timeout at construction, so a shallow copy sharing its connection pool
+    carries the shorter one.
+    """
+    client = geocodio_client
+    if deadline is not None:
+        timeout = deadline.timeout(GEOCODIO_TIMEOUT_SECONDS)
+        if timeout < client.single_timeout:
+            client = copy.copy(geocodio_client)
+            client.single_timeout = timeout
+    res = client.geocode(address)
+    logger.debug(f"Geocodio raw response: {res}")
+    if not res:
+        logger.warning("Geocodio returned empty response")
+        return None
+    
+    # Handle dict response (direct API response)
+    if isinstance(res, dict):
+        results = res.get('results', [])
+    else:
+        # Handle object response from pygeocodio
+        results = getattr(res, 'results', None)
+        if results is None and hasattr(res, 'get'):
             results = res.get('results', [])
-        else:
-            # Handle object response from pygeocodio
-            results = getattr(res, 'results', None)
-            if results is None and hasattr(res, 'get'):
-                results = res.get('results', [])
-        
-        logger.info(f"Parsed results: {results}")
-        if not results or len(results) == 0:
-            logger.warning("Geocodio returned no results")
-            return None
-        
-        first_result = results[0]
-        logger.info(f"First result type: {type(first_result)}, value: {first_result}")
-        
-        # Extract location from first result
-        if isinstance(first_result, dict):
-            loc = first_result.get('location', {})
-        elif hasattr(first_result, 'location'):
-            loc = first_result.location
-        else:
-            logger.warning(f"Cannot extract location from result: {first_result}")
-            return None
-        
-        logger.info(f"Location: {loc}")
-        
-        # Extract lat/lng from location
-        if isinstance(loc, dict):
-            lat, lng = loc.get('lat'), loc.get('lng')
-        elif hasattr(loc, 'lat'):
-            lat, lng = loc.lat, loc.lng
-        else:
-            logger.warning(f"Cannot extract lat/lng from location: {loc}")
-            return None
-        
-        if lat is None or lng is None:
-            logger.warning(f"Lat or lng is None: lat={lat}, lng={lng}")
-            return None
-        return {'lat': float(lat), 'lng': float(lng)}
+    
+    if not results or len(results) == 0:
+        logger.warning("Geocodio returned no results")
+        return None
+    
+    first_result = results[0]
+    
+    # Extract location from first result
+    if isinstance(first_result, dict):
+        loc = first_result.get('location', {})
+    elif hasattr(first_result, 'location'):
+        loc = first_result.location
+    else:
+        logger.warning(f"Cannot extract location from result: {first_result}")
+        return None
+    
+    # Extract lat/lng from location
+    if isinstance(loc, dict):
+        lat, lng = loc.get('lat'), loc.get('lng')
+    elif hasattr(loc, 'lat'):
+        lat, lng = loc.lat, loc.lng
+    else:
+        logger.warning(f"Cannot extract lat/lng from location: {loc}")
+        return None
+    
+    if lat is None or lng is None:
+        logger.warning(f"Lat or lng is None: lat={lat}, lng={lng}")
+        return None
+    return {'lat': float(lat), 'lng': float(lng)}
+
+
+def geocode_address(address, deadline=None):
+    """Geocode an address to lat/lng coordinates, through the normalized-address cache."""
+    if not address:
+        logger.warning("Geocoding skipped: no address provided")
+        return None
+
+    key = normalize_address(address)
+    cached = geocode_cache.get(key)
+    if cached is not None:
+        return cached['coord']
+
+    if geocodio_client is None:
+        logger.warning("Geocoding skipped: GEOCODIO_API_KEY not configured")
+        return None
+
+    if deadline is not None and deadline.expired:
+        logger.warning("Geocoding skipped: request deadline exceeded")
+        return None
+
+    try:
+        coord = guarded_call(
+            breakers['geocodio'], bulkheads['geocodio'], bulkhead_wait(deadline), lookup_geocodio, address, deadline
+        )
     except Exception as e:
+        # Upstream errors are not cached so the next request retries
         logger.error(f"Geocoding error: {e}")
         return None
 
+    # Addresses Geocodio could not resolve are cached for a shorter time
+    geocode_cache.set(key, {'coord': coord}, None if coord else GEOCODE_NEGATIVE_TTL)
+    return coord
+
 
-def download_image(url, max_dimension=2048):
-    """Download image from URL, resize if needed, and convert to numpy array."""
+def locate_address(address, postal_code=None, deadline=None):
+    """Resolve coordinates for an address, trying the offline postal code index first.
+
+    Returns (coord, precision) where precision is 'postal_code' or 'fsa' for
+    postal index centroids, 'address' for Geocodio results, or None.
+    """
+    postal_coord, postal_precision = (None, None)
+    if postal_index is not None and postal_code:
+        postal_coord, postal_precision = postal_index.lookup(postal_code)
+        if postal_coord and POSTAL_PRECISION_RANK[postal_precision] >= POSTAL_PRECISION_RANK[POSTAL_INDEX_MIN_PRECISION]:
+            return postal_coord, postal_precision
+
+    coord = geocode_address(address, deadline)
+    if coord:
+        return coord, 'address'
+    # Fall back to a coarser centroid rather than returning nothing
+    if postal_coord:
+        return postal_coord, postal_precision
+    return None, None
+
+
+def resolve_districts(coord):
+    """Return the federal/provincial/municipal districts containing coord, or None."""
+    if district_index is None or not coord:
+        return None
     try:
-        response = requests.get(url, timeout=15)
+        return district_index.at_point(coord['lat'], coord['lng'])
+    except Exception as e:
+        logger.error(f"District lookup error: {e}")
+        return None
+
+
+def fetch_image_bytes(url, max_bytes=None, deadline=None):
+    """Stream an image over the pooled session, aborting as soon as it exceeds max_bytes.
+
+    The requests timeout only bounds each socket read, so the deadline is also
+    checked between chunks to stop slow-drip transfers.
+    """
+    max_bytes = max_bytes or MAX_IMAGE_BYTES
+    timeout = deadline.timeout(cap=DOWNLOAD_TIMEOUT_SECONDS) if deadline else DOWNLOAD_TIMEOUT_SECONDS
+    with http_session.get(url, timeout=timeout, stream=True) as response:
         response.raise_for_status()
-        image = Image.open(BytesIO(response.content))
-        
-        if max(image.size) > max_dimension:
-            ratio = max_dimension / max(image.size)
-            new_size = tuple(int(dim * ratio) for dim in image.size)
-            image = image.resize(new_size, Image.Resampling.LANCZOS)
-            logger.info(f"Resized image to {new_size}")
-        
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        return np.array(image)
+        content_length = response.headers.get('Content-Length')
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+            raise ValueError(f"Image is {content_length} bytes, limit is {max_bytes}")
+
+        chunks = []
+        total = 0
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            total += len(chunk)
+            if total > max_bytes:
+                raise ValueError(f"Image exceeds {max_bytes} bytes")
+            if deadline is not None and deadline.expired:
+                raise DeadlineExceeded(f"Deadline exceeded after {total} bytes")
+            chunks.append(chunk)
+    DOWNLOAD_BYTES.inc(total)
+    return b''.join(chunks)
+
+
+def download_image(url, max_dimension=2048, deadline=None):
+    """Download image from URL and decode it, resized if needed, to an RGB array.
+
+    Returns an ImageSource holding the original bytes, their SHA-256 and the
+    decoded array, or None on failure.
+    """
+    try:
+        data = guarded_call(
+            breakers['storage'], bulkheads['storage'], bulkhead_wait(deadline), fetch_image_bytes, url,
+            deadline=deadline
+        )
+        source = ImageSource(data, max_dimension)
+        # Decode here so both downloads also decode in parallel
+        IMAGE_LONGEST_SIDE.labels('original').observe(max(source.original_size))
+        IMAGE_LONGEST_SIDE.labels('decoded').observe(max(source.array.shape[:2]))
+        return source
     except Exception as e:
         logger.error(f"Error downloading image from {url}: {e}")
         return None
 
 
-def match_faces(selfie, id_photo, high_accuracy=True):
-    """Compare faces in selfie and ID photo using face_recognition library."""
+def download_images(selfie_urls, id_photo_url, deadline=None):
+    """Download the selfie frames and ID photo in parallel.
+
+    Returns (list of selfie ImageSources or None per frame, ID ImageSource or None).
+    """
+    selfie_futures = [stage_executor.submit(download_image, url, deadline=deadline) for url in selfie_urls]
+    id_result = download_image(id_photo_url, deadline=deadline)
+    return [future.result() for future in selfie_futures], id_result
+
+
+def detect_faces(image):
+    """Detect face boxes, on the inference pool when it is enabled."""
+    if face_pool is not None:
+        return face_pool.detect_faces(image)
+    return faces.detect_faces(image)
+
+
+def detect_faces_frames(frames, id_photo):
+    """Detect face boxes in every selfie frame and the ID photo, frames in parallel on the stage pool."""
+    futures = [stage_executor.submit(detect_faces, frame) for frame in frames]
+    id_locations = detect_faces(id_photo)
+    return [future.result() for future in futures], id_locations
+
+
+def encode_faces(image, digest=None, high_accuracy=True, max_faces=None, num_jitters=None, locations=None):
+    """Detect and encode faces, reusing cached encodings for previously seen image bytes."""
+    key = None
+    if digest:
+        model, jitters = faces.encoding_params(high_accuracy, num_jitters)
+        key = cache_key('faces', digest, model, jitters, max_faces, faces.DETECTION_LADDER)
+        cached = face_cache.get(key)
+        if cached is not None:
+            return cached
+
+    if face_pool is not None:
+        result = face_pool.encode_faces(image, high_accuracy, max_faces, num_jitters, locations)
+    else:
+        result = faces.encode_faces(image, high_accuracy, max_faces, num_jitters, locations)
+
+    if key:
+        face_cache.set(key, result)
+    return result
+
+
+def compare_encoded_faces(selfie, id_photo, high_accuracy, selfie_digest, id_digest, num_jitters=None,
+                          selfie_locations=None, id_locations=None):
+    selfie_faces = encode_faces(
+        selfie, selfie_digest, high_accuracy, max_faces=1, num_jitters=num_jitters, locations=selfie_locations
+    )
+    id_faces = encode_faces(id_photo, id_digest, high_accuracy, num_jitters=num_jitters, locations=id_locations)
+    return faces.compare_faces(selfie_faces, id_faces, high_accuracy)
+
+
+def match_faces(selfie, id_photo, high_accuracy=True, selfie_digest=None, id_digest=None,
+                selfie_locations=None, id_locations=None):
+    """Compare faces in selfie and ID photo, on the inference pool when it is enabled.
+
+    In adaptive jitter mode the faces are first encoded with a single jitter, and
+    only re-encoded with the full jitter count when the score lands within
+    FACE_JITTER_BAND of FACE_MATCH_THRESHOLD. The result's encoding_path is
+    'fixed', 'fast' or 'escalated'. Face boxes from an earlier detection pass can be
+    given as selfie_locations/id_locations to skip detecting again.
+    """
+    locations = {'selfie_locations': selfie_locations, 'id_locations': id_locations}
     try:
-        model = 'large' if high_accuracy else 'small'
-        num_jitters = 5 if high_accuracy else 1
-        
-        logger.info(f"Face encoding with model={model}, num_jitters={num_jitters}")
-        
-        selfie_locations = face_recognition.face_locations(selfie, model='hog')
-        id_locations = face_recognition.face_locations(id_photo, model='hog')
-        
-        if len(selfie_locations) == 0:
-            return {'success': False, 'reason': 'No face detected in selfie'}
-        
-        if len(id_locations) == 0:
-            return {'success': False, 'reason': 'No face detected in ID photo'}
-        
-        if len(selfie_locations) > 1:
-            return {'success': False, 'reason': 'Multiple faces detected in selfie'}
-        
-        selfie_encodings = face_recognition.face_encodings(
-            selfie, 
-            known_face_locations=selfie_locations,
-            num_jitters=num_jitters,
-            model=model
-        )
-        id_encodings = face_recognition.face_encodings(
-            id_photo, 
-            known_face_locations=id_locations,
-            num_jitters=num_jitters,
-            model=model
+        if FACE_JITTER_MODE != 'adaptive' or not high_accuracy:
+            result = compare_encoded_faces(selfie, id_photo, high_accuracy, selfie_digest, id_digest, **locations)
+            result['encoding_path'] = 'fixed'
+            return result
+
+        result = compare_encoded_faces(
+            selfie, id_photo, high_accuracy, selfie_digest, id_digest, num_jitters=1, **locations
         )
-        
-        if len(selfie_encodings) == 0 or len(id_encodings) == 0:
-            return {'success': False, 'reason': 'Failed to encode detected faces'}
-        
-        face_distance = face_recognition.face_distance(id_encodings, selfie_encodings[0])
-        match_score = 1.0 - float(face_distance[0])
-        
-        return {
-            'success': True,
-            'match_score': round(match_score, 3),
-            'reason': 'Faces compared successfully',
-            'accuracy_mode': 'high' if high_accuracy else 'standard'
-        }
-        
+        if not result['success'] or abs(result['match_score'] - FACE_MATCH_THRESHOLD) > FACE_JITTER_BAND:
+            result['encoding_path'] = 'fast'
+            return result
+
+        logger.info(f"Score {result['match_score']} is near the threshold, re-encoding with full jitters")
+        result = compare_encoded_faces(selfie, id_photo, high_accuracy, selfie_digest, id_digest, **locations)
+        result['encoding_path'] = 'escalated'
+        return result
     except Exception as e:
         logger.error(f"Face matching error: {e}")
         return {'success': False, 'reason': f'Face matching error: {str(e)}'}
 
 
-def extract_id_info_with_openai(id_image, id_type='drivers_license'):
-    """Extract ID information using OpenAI Vision API.
-    
-    This handles all ID types (driver's license, passport, medical card) reliably
-    using GPT-4 Vision instead of traditional OCR.
+def create_vision_completion(messages, timeout=NOT_GIVEN, cancelled=None):
+    """Call the vision model and return (response_text, usage).
+
+    Hedged calls pass a `cancelled` HedgeCancel and are streamed. The winning call
+    closes the loser's stream as soon as it wins, so the loser stops instead of
+    running to completion or waiting for its next chunk.
     """
-    if not openai_client:
-        logger.error("OpenAI client not initialized - missing API key")
-        return {
-            'success': False,
-            'first_name': None,
-            'last_name': None,
-            'address': None,
-            'confidence': 0.0,
-            'error': 'OpenAI API key not configured'
-        }
-    
+    # A timeout is the deadline's remaining time, which the SDK's automatic retries
+    # would each get again in full, so calls under a deadline are not retried
+    client = openai_client if timeout is NOT_GIVEN else openai_client.with_options(max_retries=0)
+    if cancelled is None:
+        response = client.chat.completions.create(
+            model=OPENAI_VISION_MODEL, messages=messages, max_tokens=500, timeout=timeout
+        )
+        return response.choices[0].message.content, getattr(response, 'usage', None)
+
+    stream = client.chat.completions.create(
+        model=OPENAI_VISION_MODEL, messages=messages, max_tokens=500, timeout=timeout,
+        stream=True, stream_options={'include_usage': True}
+    )
+    cancelled.on_cancel(stream.close)
+    parts, usage = [], None
     try:
-        # Convert numpy array to PIL Image if needed
-        if isinstance(id_image, np.ndarray):
-            pil_image = Image.fromarray(id_image)
-        else:
-            pil_image = id_image
-        
-        # Convert image to base64
-        buffered = BytesIO()
-        pil_image.save(buffered, format="JPEG", quality=95)
-        img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-        
-        # Build prompt based on ID type
-        if id_type == 'medical_card':
-            prompt = """Analyze this Quebec Health Insurance Card (RAMQ card) image.
+        for chunk in stream:
+            if cancelled.is_set():
+                raise HedgeCancelled()
+            if chunk.usage:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+    except Exception as e:
+        # A stream closed by the winner fails mid-read; report it as the cancellation it is
+        if cancelled.is_set() and not isinstance(e, HedgeCancelled):
+            raise HedgeCancelled() from e
+        raise
+    finally:
+        stream.close()
+    return ''.join(parts), usage
+
+
+def complete_vision(messages, timeout=NOT_GIVEN, wait_timeout=None):
+    """Run a vision completion, hedged when hedging is enabled. Returns (response_text, usage)."""
+    if openai_hedger is not None:
+        return openai_hedger.run(
+            lambda cancelled: create_vision_completion(messages, timeout, cancelled), wait_timeout
+        )
+    return create_vision_completion(messages, timeout)
+
+
+def train_face_index_if_needed():
+    """Train the face index quantizer in a background thread once it is large enough,
+    and retrain it when rows added since the last training exceed 20% of the index."""
+    if face_index is None or FACE_INDEX_CLUSTERS <= 0:
+        return
+    rows = len(face_index)
+    untrained = face_index.untrained_rows
+    if rows < FACE_INDEX_TRAIN_MIN_ROWS or (untrained < rows and untrained <= 0.2 * (rows - untrained)):
+        return
+    if not face_index_training.acquire(blocking=False):
+        return
+
+    def train():
+        try:
+            face_index.train(FACE_INDEX_CLUSTERS)
+        except Exception as e:
+            logger.error(f"Face index training failed: {e}")
+        finally:
+            face_index_training.release()
+
+    threading.Thread(target=train, name='face-index-train', daemon=True).start()
+
+
+def search_face_index(encoding, subject_id=None):
+    """Return earlier verified faces similar to encoding, excluding subject_id's own entries."""
+    matches = face_index.search(encoding, FACE_INDEX_MAX_DISTANCE, FACE_INDEX_MAX_MATCHES, exclude_subject=subject_id)
+    return [{'subject_id': match['subject_id'], 'similarity': round(1.0 - match['distance'], 3)} for match in matches]
+
+
+def find_reused_id_photo(id_image, record_id, update_index=True):
+    """Hash the ID photo and return near-duplicates from other attempts, then record this one."""
+    try:
+        value = phash(id_image)
+        matches = id_hash_index.search(value, ID_HASH_MAX_DISTANCE, ID_HASH_MAX_MATCHES, exclude_record=record_id)
+        if update_index:
+            id_hash_index.add(record_id, value)
+        return matches
+    except Exception as e:
+        logger.error(f"ID photo hash error: {e}")
+        return None
+
+
+def match_face_frames(frames, id_photo, frame_digests, id_digest, frame_locations=None, id_locations=None):
+    """Encode every selfie frame in parallel on the inference pool and score all of them
+    against the ID face in one vectorized comparison (see faces.compare_frames)."""
+    try:
+        frame_locations = frame_locations or [None] * len(frames)
+        futures = [
+            stage_executor.submit(encode_faces, frame, digest, True, 1, None, locations)
+            for frame, digest, locations in zip(frames, frame_digests, frame_locations)
+        ]
+        id_faces = encode_faces(id_photo, id_digest, True, locations=id_locations)
+        frame_faces = [future.result() for future in futures]
+        result = faces.compare_frames(frame_faces, id_faces, SELFIE_FRAME_AGGREGATION, SELFIE_FRAME_BEST_K)
+        result['encoding_path'] = 'multi_frame'
+        return result
+    except Exception as e:
+        logger.error(f"Face matching error: {e}")
+        return {'success': False, 'reason': f'Face matching error: {str(e)}'}
+
+
+# Extraction prompt per ID type; other types use the driver's license prompt. A hash of
+# the prompt is part of the extraction cache key, so editing a prompt invalidates the
+# cached extractions made with the old one.
+ID_EXTRACTION_PROMPTS = {
+    'medical_card': """Analyze this Quebec Health Insurance Card (RAMQ card) image.
 Extract the following information and return it as JSON:
 {
     "first_name": "the person's first name (prénom)",
@@ -208,10 +738,8 @@ Extract the following information and return it as JSON:
     "nam": "the health insurance number (XXXX 0000 0000 format) if visible"
 }
 The name appears below "PRÉNOM ET NOM À LA NAISSANCE" on the card.
-Return ONLY the JSON object, no other text."""
-
-        elif id_type == 'passport':
-            prompt = """Analyze this Canadian Passport image.
+Return ONLY the JSON object, no other text.""",
+    'passport': """Analyze this Canadian Passport image.
 Extract the following information and return it as JSON:
 {
     "first_name": "the person's first/given name",
@@ -221,10 +749,8 @@ Extract the following information and return it as JSON:
     "expiration": "expiration date in YYYY-MM-DD format if visible",
     "passport_number": "passport number if visible"
 }
-Return ONLY the JSON object, no other text."""
-
-        else:  # drivers_license
-            prompt = """Analyze this Quebec Driver's License image.
+Return ONLY the JSON object, no other text.""",
+    'drivers_license': """Analyze this Quebec Driver's License image.
 Extract the following information and return it as JSON:
 {
     "first_name": "the person's first name (prénom)",
@@ -236,32 +762,95 @@ Extract the following information and return it as JSON:
     "address_postal": "postal code if visible",
     "license_number": "license number if visible"
 }
-Return ONLY the JSON object, no other text."""
+Return ONLY the JSON object, no other text.""",
+}
+ID_EXTRACTION_PROMPT_HASHES = {
+    id_type: hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:16] for id_type, prompt in ID_EXTRACTION_PROMPTS.items()
+}
+
+
+def extraction_prompt(id_type):
+    """Return (prompt, prompt_hash) for id_type."""
+    key = id_type if id_type in ID_EXTRACTION_PROMPTS else 'drivers_license'
+    return ID_EXTRACTION_PROMPTS[key], ID_EXTRACTION_PROMPT_HASHES[key]
+
+
+def extract_id_info_cached(id_image, id_type, digest=None, deadline=None):
+    """Extract ID information, reusing a cached extraction for previously seen ID image bytes."""
+    if not digest:
+        return extract_id_info_with_openai(id_image, id_type, deadline)
+
+    _, prompt_hash = extraction_prompt(id_type)
+    key = cache_key('extraction', digest, id_type, OPENAI_VISION_MODEL, ID_PAYLOAD_PROFILES.get(id_type), prompt_hash)
+    cached = extraction_cache.get(key)
+    if cached is not None:
+        return dict(cached)
+
+    result = extract_id_info_with_openai(id_image, id_type, deadline)
+    # Only successfully parsed responses are cached; API and parse errors are retried
+    if 'error' not in result:
+        extraction_cache.set(key, dict(result))
+    return result
+
+
+def extract_id_info_with_openai(id_image, id_type='drivers_license', deadline=None):
+    """Extract ID information using OpenAI Vision API.
+    
+    This handles all ID types (driver's license, passport, medical card) reliably
+    using GPT-4 Vision instead of traditional OCR. With a deadline, the API call
+    is given only the time left in the request's budget.
+    """
+    if not openai_client:
+        logger.error("OpenAI client not initialized - missing API key")
+        return {
+            'success': False,
+            'first_name': None,
+            'last_name': None,
+            'address': None,
+            'confidence': 0.0,
+            'error': 'OpenAI API key not configured'
+        }
+    
+    try:
+        # Crop to the card and size it to the fewest vision tiles this id_type needs
+        payload = prepare_id_payload(id_image, id_type)
+        prompt, _ = extraction_prompt(id_type)
 
         logger.info(f"Calling OpenAI Vision API for {id_type}")
         
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{img_base64}",
-                                "detail": "high"
-                            }
+        started = time.perf_counter()
+        timeout = deadline.timeout() if deadline else NOT_GIVEN
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{payload['base64']}",
+                            "detail": payload['detail']
                         }
-                    ]
-                }
-            ],
-            max_tokens=500
+                    }
+                ]
+            }
+        ]
+        response_text, usage = guarded_call(
+            breakers['openai'], bulkheads['openai'], bulkhead_wait(deadline), complete_vision,
+            messages, timeout, deadline.remaining() if deadline else None
         )
         
+        logger.info(
+            f"OpenAI vision payload for {id_type}: {payload['bytes']} bytes, {payload['size'][0]}x{payload['size'][1]}, "
+            f"detail={payload['detail']}, cropped={payload['cropped']}, reencoded={payload['reencoded']}, "
+            f"estimated_image_tokens={payload['estimated_tokens']}, "
+            f"prompt_tokens={getattr(usage, 'prompt_tokens', None)}, "
+            f"completion_tokens={getattr(usage, 'completion_tokens', None)}, "
+            f"latency_ms={round((time.perf_counter() - started) * 1000, 1)}"
+        )
+
         # Parse the response
-        response_text = response.choices[0].message.content.strip()
+        response_text = response_text.strip()
         logger.info(f"OpenAI response: {response_text}")
         
         # Clean up response - remove markdown code blocks if present
@@ -342,79 +931,412 @@ def health():
     return jsonify({'status': 'healthy'}), 200
 
 
-@app.route('/verify', methods=['POST'])
-def verify():
-    """Main verification endpoint."""
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 503 until this worker has finished its warm-up inference."""
+    status = worker_startup.status()
+    record_worker_memory(status['memory'])
+    return jsonify(status), 200 if status['ready'] else 503
+
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counts for the stage result caches in this worker."""
+    return jsonify({
+        'faces': face_cache.stats(),
+        'extraction': extraction_cache.stats(),
+        'geocode': geocode_cache.stats()
+    }), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics, aggregated across gunicorn workers when PROMETHEUS_MULTIPROC_DIR is set."""
+    record_worker_memory()
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+
+@app.route('/status', methods=['GET'])
+def dependency_status():
+    """Circuit breaker states, bulkhead usage and admission control for this worker."""
+    return jsonify({
+        'breakers': {name: breaker.status() for name, breaker in breakers.items()},
+        'bulkheads': {name: bulkhead.status() for name, bulkhead in bulkheads.items()},
+        'admission': admission.stats()
+    }), 200
+
+
+@app.route('/hedge/stats', methods=['GET'])
+def hedge_stats():
+    """Hedge rate and win counts for OpenAI vision calls in this worker."""
+    if openai_hedger is None:
+        return jsonify({'enabled': False}), 200
+    return jsonify({'enabled': True, **openai_hedger.stats()}), 200
+
+
+def admin_auth_error():
+    """Error response unless the request carries the ADMIN_TOKEN bearer token; admin routes are off without one."""
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'ADMIN_TOKEN is not configured'}), 403
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {ADMIN_TOKEN}'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return None
+
+
+@app.route('/admin/memory', methods=['GET'])
+def memory_report():
+    """Memory growth report for this worker; ?snapshot=1 takes a tracemalloc snapshot and logs it to the report file."""
+    auth_error = admin_auth_error()
+    if auth_error:
+        return auth_error
+    snapshot = request.args.get('snapshot', '').lower() in ('1', 'true', 'yes')
+    report = memory_monitor.report(snapshot=snapshot)
+    if snapshot:
+        memory_monitor.write_report(report)
+    return jsonify(report), 200
+
+
+def timed_stage(timings, stage, fn, *args):
+    """Run fn(*args) and record its wall-clock duration in milliseconds under timings[stage]."""
+    start = time.perf_counter()
     try:
+        return fn(*args)
+    finally:
+        elapsed = time.perf_counter() - start
+        timings[stage] = round(elapsed * 1000, 1)
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+
+
+def check_quality(selfie_frames, id_image, frame_locations=None):
+    """Run the quality gate on the selfie frames and the ID photo.
+
+    Returns (failure_reason_or_None, metrics, passing) where passing lists the
+    indices of the frames that passed. Failing frames are only dropped; the
+    selfie is rejected when no frame passes.
+    """
+    frame_locations = frame_locations or [None] * len(selfie_frames)
+    frame_metrics, failures = [], []
+    for frame, locations in zip(selfie_frames, frame_locations):
+        selfie_box = locations[0] if locations and len(locations) == 1 else None
+        frame_metrics.append(assess_image(frame, selfie_box))
+        failures.append(quality_failure(
+            frame_metrics[-1], 'Selfie',
+            min_face_fraction=QUALITY_MIN_FACE_FRACTION if selfie_box else None,
+            **QUALITY_THRESHOLDS
+        ))
+    passing = [i for i, failure in enumerate(failures) if failure is None]
+
+    metrics = {
+        'selfie': frame_metrics[passing[0] if passing else 0],
+        'id_photo': assess_image(id_image)
+    }
+    if len(selfie_frames) > 1:
+        metrics['selfie_frames'] = frame_metrics
+    failure = failures[0] if not passing else None
+    if failure is None:
+        failure = quality_failure(metrics['id_photo'], 'ID photo', **QUALITY_THRESHOLDS)
+    return failure, metrics, passing
+
+
+def extract_and_geocode(id_image, id_type, timings, id_digest=None, geocode=True, deadline=None, partial=None):
+    """Extract ID info, then geocode the extracted address as soon as it is available.
+
+    The OCR result is also stored in partial['ocr'] so a caller that stops waiting
+    at its deadline can still use it while geocoding is in flight.
+    """
+    ocr_result = timed_stage(timings, 'ocr', extract_id_info_cached, id_image, id_type, id_digest, deadline)
+    if partial is not None:
+        partial['ocr'] = ocr_result
+    if not geocode:
+        return ocr_result, None, None
+
+    # For driver's license, append Canada to ensure Canadian geocoding
+    dl_address = ocr_result.get('address')
+    if dl_address and 'Canada' not in dl_address:
+        dl_address = f"{dl_address}, Canada"
+    address_coord, coord_precision = timed_stage(
+        timings, 'geocode', locate_address, dl_address, ocr_result.get('address_postal'), deadline
+    )
+    return ocr_result, address_coord, coord_precision
+
+
+VALID_ID_TYPES = ['passport', 'drivers_license', 'medical_card']
+
+
+def selfie_frame_urls(data):
+    """Selfie frame URLs of a payload: selfie_urls, or the single selfie_url."""
+    return data.get('selfie_urls') or [data.get('selfie_url')]
+
+
+def validate_verify_payload(data):
+    """Return an error message if a verification payload is invalid, otherwise None."""
+    if not data:
+        return 'No JSON data provided'
+    selfie_urls = data.get('selfie_urls')
+    if selfie_urls is not None:
+        if not isinstance(selfie_urls, list) or not selfie_urls or not all(
+                isinstance(url, str) and url for url in selfie_urls):
+            return 'selfie_urls must be a non-empty list of URLs'
+        if len(selfie_urls) > VERIFY_MAX_SELFIE_FRAMES:
+            return f'At most {VERIFY_MAX_SELFIE_FRAMES} selfie frames'
+    if not (selfie_urls or data.get('selfie_url')) or not data.get('id_photo_url'):
+        return 'Missing required image URLs'
+    id_type = data.get('id_type', 'drivers_license')
+    if id_type not in VALID_ID_TYPES:
+        return f'Invalid id_type. Must be one of: {VALID_ID_TYPES}'
+    return None
+
+
+def request_deadline(deadline_ms=None):
+    """Build a request Deadline from an optional millisecond budget, clamped to the configured maximum."""
+    seconds = VERIFY_DEADLINE_SECONDS
+    if deadline_ms:
         try:
-            data = request.get_json(force=True, silent=False)
-        except Exception as json_err:
-            logger.error(f"JSON parsing error: {json_err}")
-            return jsonify({'error': f'Invalid JSON: {str(json_err)}'}), 400
-        
-        if not data:
-            return jsonify({'error': 'No JSON data provided'}), 400
-        
-        selfie_url = data.get('selfie_url')
+            parsed = float(deadline_ms) / 1000
+        except ValueError:
+            parsed = None
+        # nan slips through the clamp below and inf would silently become the maximum
+        if parsed is not None and math.isfinite(parsed):
+            seconds = parsed
+        else:
+            logger.warning(f"Ignoring invalid deadline: {deadline_ms}")
+    return Deadline(min(max(seconds, 1.0), VERIFY_DEADLINE_MAX_SECONDS))
+
+
+def run_verification(data, deadline=None, sources=None, update_indexes=True):
+    """Run the full verification pipeline and return (response_body, status_code).
+
+    Shared by the synchronous /verify endpoint and the background job workers.
+    When the deadline runs out while OCR or geocoding are still in flight, the
+    face result is returned with those stages listed in timed_out_stages; the
+    abandoned OCR call still fills the extraction cache for a retry.
+    Batch runs pass already downloaded (selfie frames, id) ImageSources as `sources`,
+    and update_indexes=False so re-processing does not add duplicate index entries.
+    """
+    request_start = time.perf_counter()
+    deadline = deadline or request_deadline()
+    try:
+        selfie_urls = selfie_frame_urls(data)
         id_photo_url = data.get('id_photo_url')
         id_type = data.get('id_type', 'drivers_license')
         manual_address = data.get('manual_address')
-        
-        if not selfie_url or not id_photo_url:
-            return jsonify({'error': 'Missing required image URLs'}), 400
-        
-        valid_id_types = ['passport', 'drivers_license', 'medical_card']
-        if id_type not in valid_id_types:
-            return jsonify({'error': f'Invalid id_type. Must be one of: {valid_id_types}'}), 400
-        
+        subject_id = data.get('subject_id')
+
         logger.info(f"Processing verification for id_type: {id_type}")
         
-        # Download images
-        selfie_image = download_image(selfie_url)
-        id_image = download_image(id_photo_url)
+        timings = {}
+
+        # Download images, unless a batch run has prefetched them
+        if sources is None:
+            sources = timed_stage(
+                timings, 'download',
+                download_images, selfie_urls, id_photo_url, deadline
+            )
+        selfie_sources, id_source = sources
+        # A frame that failed to download is dropped as long as another one remains
+        frame_sources = [source for source in selfie_sources if source is not None]
         
-        if selfie_image is None or id_image is None:
-            return jsonify({
+        if not frame_sources or id_source is None:
+            if deadline.expired:
+                return {
+                    'verified': False,
+                    'reason': 'Deadline exceeded while downloading images',
+                    'face_match_score': 0.0,
+                    'timed_out_stages': ['download'],
+                    'timings_ms': timings
+                }, 504
+            if breakers['storage'].status()['state'] == 'open':
+                return {
+                    'verified': False,
+                    'reason': 'Image storage is unavailable, retry later',
+                    'face_match_score': 0.0,
+                    'timings_ms': timings
+                }, 503
+            return {
                 'verified': False,
                 'reason': 'Failed to download images',
-                'face_match_score': 0.0
-            }), 400
-        
-        # Perform face matching
-        face_match_result = match_faces(selfie_image, id_image)
-        
-        # Extract ID info using OpenAI Vision
-        ocr_result = extract_id_info_with_openai(id_image, id_type)
+                'face_match_score': 0.0,
+                'timings_ms': timings
+            }, 400
+
+        id_image, id_digest = id_source.array, id_source.digest
+
+        # Cheap enough to run next to face detection on the stage pool. Like the face
+        # index, it needs a subject_id to exclude the subject's own earlier attempts.
+        id_hash_future = None
+        if id_hash_index is not None and subject_id:
+            id_hash_future = stage_executor.submit(
+                timed_stage, timings, 'id_hash', find_reused_id_photo, id_image, subject_id, update_indexes
+            )
         
-        # Handle manual address for geocoding
+        # With a fail-fast policy, cheap face detection runs first so a definitive
+        # failure can skip the paid OCR and geocoding calls
+        frame_locations = id_locations = None
+        detection_failure = None
+        if FAIL_FAST_POLICY != 'off':
+            with bulkheads['face'].acquire(bulkhead_wait(deadline, FACE_BULKHEAD_WAIT_SECONDS)):
+                frame_locations, id_locations = timed_stage(
+                    timings, 'face_detect', detect_faces_frames, [source.array for source in frame_sources], id_image
+                )
+            # Frames without exactly one face are dropped; the first frame reports the failure if none is left
+            usable = [i for i, locations in enumerate(frame_locations) if len(locations) == 1] or [0]
+            frame_sources = [frame_sources[i] for i in usable]
+            frame_locations = [frame_locations[i] for i in usable]
+            detection_failure = faces.detection_failure(len(frame_locations[0]), len(id_locations))
+
+        # Blurry, dark or tiny-face photos are rejected before any encoding or API cost
+        quality = None
+        if QUALITY_GATE_ENABLED and detection_failure is None:
+            quality_reason, quality, passing = timed_stage(
+                timings, 'quality', check_quality, [source.array for source in frame_sources], id_image, frame_locations
+            )
+            if passing:
+                frame_sources = [frame_sources[i] for i in passing]
+                frame_locations = [frame_locations[i] for i in passing] if frame_locations else None
+            if quality_reason:
+                logger.info(f"Quality gate rejected images: {quality_reason} {quality}")
+                return {
+                    'verified': False,
+                    'reason': quality_reason,
+                    'face_match_score': 0.0,
+                    'quality': quality,
+                    'skipped_stages': ['face_match', 'ocr', 'geocode'],
+                    'timings_ms': timings
+                }, 200
+
+        run_ocr = detection_failure is None or FAIL_FAST_POLICY == 'ocr_only'
+        run_geocode = detection_failure is None
+        skipped_stages = []
+        if detection_failure:
+            skipped_stages = ['face_match'] + (['ocr'] if not run_ocr else []) + ['geocode']
+            logger.info(f"Face detection failed ({detection_failure}), skipping {skipped_stages}")
+
+        # OCR and geocoding are network-bound, so they run on the stage pool
+        # while face matching uses this request thread.
+        ocr_future = geocode_future = None
+        partial = {}
         if manual_address:
             manual_full_address = f"{manual_address.get('street')}, {manual_address.get('city')}, QC {manual_address.get('postalCode')}, Canada"
-            logger.info(f"Geocoding manual address: {manual_full_address}")
-            address_coord = geocode_address(manual_full_address)
-            logger.info(f"Geocoding result for manual address: {address_coord}")
+            if run_geocode:
+                logger.info(f"Geocoding manual address: {manual_full_address}")
+                geocode_future = stage_executor.submit(
+                    timed_stage, timings, 'geocode', locate_address, manual_full_address, manual_address.get('postalCode'),
+                    deadline
+                )
+            if run_ocr:
+                ocr_future = stage_executor.submit(
+                    timed_stage, timings, 'ocr', extract_id_info_cached, id_source, id_type, id_digest, deadline
+                )
+        elif run_ocr:
+            ocr_future = stage_executor.submit(
+                extract_and_geocode, id_source, id_type, timings, id_digest, run_geocode, deadline, partial
+            )
+
+        selfie_source = frame_sources[0]
+        selfie_image, selfie_digest = selfie_source.array, selfie_source.digest
+        selfie_locations = frame_locations[0] if frame_locations else None
+
+        # Perform face matching
+        if detection_failure:
+            face_match_result = {'success': False, 'reason': detection_failure}
+        elif len(frame_sources) > 1:
+            with bulkheads['face'].acquire(bulkhead_wait(deadline, FACE_BULKHEAD_WAIT_SECONDS)):
+                face_match_result = timed_stage(
+                    timings, 'face_match', match_face_frames, [source.array for source in frame_sources], id_image,
+                    [source.digest for source in frame_sources], id_digest, frame_locations, id_locations
+                )
+        else:
+            with bulkheads['face'].acquire(bulkhead_wait(deadline, FACE_BULKHEAD_WAIT_SECONDS)):
+                face_match_result = timed_stage(
+                    timings, 'face_match', match_faces, selfie_image, id_image, True, selfie_digest, id_digest,
+                    selfie_locations, id_locations
+                )
+
+        # Searched while OCR is still running on the stage pool. Without a subject_id the
+        # caller's own earlier entries cannot be told apart from other people's, so the
+        # index is neither searched nor updated.
+        face_index_matches = None
+        if face_index is not None and subject_id and face_match_result['success']:
+            try:
+                face_index_matches = timed_stage(
+                    timings, 'face_index', search_face_index, face_match_result['selfie_encoding'], subject_id
+                )
+            except Exception as e:
+                logger.error(f"Face index search error: {e}")
+
+        ocr_result = {'success': False, 'confidence': 0.0, 'note': 'Skipped: face detection failed'}
+        ocr_status = 'skipped'
+        address_coord, coord_precision = None, None
+        timed_out_stages = []
+        if ocr_future is not None:
+            result, timed_out = wait_for(ocr_future, deadline)
+            if not timed_out and manual_address:
+                ocr_result, ocr_status = result, 'complete'
+            elif not timed_out:
+                (ocr_result, address_coord, coord_precision), ocr_status = result, 'complete'
+            elif 'ocr' in partial:
+                # OCR finished; only geocoding of the extracted address ran out of time
+                ocr_result, ocr_status = partial['ocr'], 'complete'
+                timed_out_stages.append('geocode')
+            else:
+                ocr_result = {'success': False, 'confidence': 0.0, 'note': 'OCR timed out, retry to fetch the result'}
+                ocr_status = 'timed_out'
+                timed_out_stages += ['ocr'] + (['geocode'] if run_geocode and not manual_address else [])
+        if geocode_future is not None:
+            result, timed_out = wait_for(geocode_future, deadline)
+            if timed_out:
+                timed_out_stages.append('geocode')
+            else:
+                address_coord, coord_precision = result
+                logger.info(f"Geocoding result for manual address: {address_coord}")
+        if timed_out_stages:
+            logger.warning(f"Deadline of {deadline.seconds}s exceeded, returning without {timed_out_stages}")
+
+        if manual_address:
             ocr_result['address'] = manual_full_address
             ocr_result['address_line1'] = manual_address.get('street')
             ocr_result['address_city'] = manual_address.get('city')
             ocr_result['address_postal'] = manual_address.get('postalCode')
             ocr_result['address_source'] = 'manual'
         else:
-            # For driver's license, append Canada to ensure Canadian geocoding
-            dl_address = ocr_result.get('address')
-            if dl_address and 'Canada' not in dl_address:
-                dl_address = f"{dl_address}, Canada"
-            address_coord = geocode_address(dl_address)
             ocr_result['address_source'] = 'openai_vision'
 
+        districts = resolve_districts(address_coord)
+
+        timings['total'] = round((time.perf_counter() - request_start) * 1000, 1)
+        STAGE_SECONDS.labels('total').observe(timings['total'] / 1000)
+        logger.info(f"Stage timings (ms): {timings}")
+
         # Clean up
         del selfie_image
         del id_image
-        gc.collect()
+        for source in selfie_sources:
+            if source is not None:
+                source.release()
+        id_source.release()
         
+        id_photo_duplicates = None
+        if id_hash_future is not None:
+            id_photo_duplicates, _ = wait_for(id_hash_future, deadline)
+            if id_photo_duplicates:
+                logger.warning(f"ID photo resembles {len(id_photo_duplicates)} earlier attempts")
+
+        selfie_frames = None
+        if len(selfie_urls) > 1:
+            selfie_frames = {
+                'received': len(selfie_urls),
+                'used': face_match_result.get('frames_used', len(frame_sources)),
+                'scores': face_match_result.get('frame_scores')
+            }
+
         if not face_match_result['success']:
-            return jsonify({
+            return {
                 'verified': False,
                 'reason': face_match_result['reason'],
                 'face_match_score': 0.0,
+                'face_encoding_path': face_match_result.get('encoding_path'),
+                'selfie_frames': selfie_frames,
                 'ocr_data': {
                     'detected': ocr_result.get('success', False),
                     'confidence': ocr_result.get('confidence', 0),
@@ -423,18 +1345,37 @@ def verify():
                     'last_name': ocr_result.get('last_name'),
                     'address': ocr_result.get('address'),
                     'address_coord': address_coord,
+                    'address_coord_precision': coord_precision,
+                    'status': ocr_status,
                     'note': 'Face matching failed'
-                }
-            }), 200
+                },
+                'id_photo_duplicates': id_photo_duplicates,
+                'districts': districts,
+                'quality': quality,
+                'skipped_stages': skipped_stages,
+                'timed_out_stages': timed_out_stages,
+                'timings_ms': timings
+            }, 200
         
-        is_verified = face_match_result['match_score'] >= 0.4
+        is_verified = face_match_result['match_score'] >= FACE_MATCH_THRESHOLD
+        FACE_MATCH_SCORE.observe(face_match_result['match_score'])
+        if face_index_matches:
+            logger.warning(f"Selfie resembles {len(face_index_matches)} previously verified subjects")
+        if is_verified and update_indexes and face_index is not None and subject_id:
+            try:
+                face_index.add(subject_id, face_match_result['selfie_encoding'])
+                train_face_index_if_needed()
+            except Exception as e:
+                logger.error(f"Face index update error: {e}")
         
         logger.info(f"Verification result: {is_verified}, score: {face_match_result['match_score']}")
         logger.info(f"Extracted: First={ocr_result.get('first_name')}, Last={ocr_result.get('last_name')}")
         
-        return jsonify({
+        return {
             'verified': is_verified,
             'face_match_score': face_match_result['match_score'],
+            'face_encoding_path': face_match_result.get('encoding_path'),
+            'selfie_frames': selfie_frames,
             'ocr_data': {
                 'detected': ocr_result.get('success', False),
                 'confidence': ocr_result.get('confidence', 0),
@@ -446,14 +1387,321 @@ def verify():
                 'address_city': ocr_result.get('address_city'),
                 'address_postal': ocr_result.get('address_postal'),
                 'address_coord': address_coord,
+                'address_coord_precision': coord_precision,
+                'status': ocr_status,
                 'note': ocr_result.get('note')
             },
-            'reason': 'Face match successful' if is_verified else 'Face match score too low'
-        }), 200
+            'reason': 'Face match successful' if is_verified else 'Face match score too low',
+            'face_index_matches': face_index_matches,
+            'id_photo_duplicates': id_photo_duplicates,
+            'districts': districts,
+            'quality': quality,
+            'skipped_stages': skipped_stages,
+            'timed_out_stages': timed_out_stages,
+            'timings_ms': timings
+        }, 200
         
+    except BulkheadFullError as e:
+        logger.warning(f"Verification rejected: {e}")
+        return {'verified': False, 'reason': 'Face matching is at capacity, retry later', 'face_match_score': 0.0}, 503
     except Exception as e:
         logger.error(f"Internal error: {e}")
-        return jsonify({'error': f'Internal error: {str(e)}'}), 500
+        return {'error': f'Internal error: {str(e)}'}, 500
+
+
+def create_job_store():
+    """Build the job store selected by VERIFY_JOB_BACKEND (sqlite or memory)."""
+    if VERIFY_JOB_BACKEND == 'memory':
+        return MemoryJobStore(ttl_seconds=VERIFY_JOB_TTL)
+    return SQLiteJobStore(VERIFY_JOB_DB_PATH, ttl_seconds=VERIFY_JOB_TTL)
+
+
+def run_verification_job(data):
+    with memory_monitor.track('job'):
+        return run_verification(data)
+
+
+job_queue = JobQueue(
+    run_verification_job,
+    create_job_store(),
+    workers=VERIFY_JOB_WORKERS,
+    max_pending=VERIFY_JOB_MAX_PENDING,
+    lease_seconds=VERIFY_JOB_LEASE_SECONDS,
+    max_attempts=VERIFY_JOB_MAX_ATTEMPTS,
+    purge_seconds=VERIFY_JOB_PURGE_SECONDS,
+    callback_secret=VERIFY_CALLBACK_SECRET
+)
+
+
+def warm_up_faces():
+    """Detect faces and encode a fixed box on a synthetic image, in every face pool process."""
+    image = synthetic_image()
+    side = image.shape[0]
+    location = [(side // 4, 3 * side // 4, 3 * side // 4, side // 4)]
+    if face_pool is None:
+        faces.detect_faces(image)
+        faces.encode_faces(image, num_jitters=1, locations=location)
+        return
+    # Submitted together so the pool starts all of its processes rather than reusing the first
+    futures = [
+        stage_executor.submit(face_pool.encode_faces, image, True, None, 1, location)
+        for _ in range(FACE_POOL_PROCESSES)
+    ]
+    futures.append(stage_executor.submit(face_pool.detect_faces, image))
+    for future in futures:
+        future.result()
+
+
+def warm_up_images():
+    """Run the quality gate and ID hash once on a synthetic image."""
+    image = synthetic_image()
+    assess_image(image)
+    phash(image)
+
+
+def record_worker_memory(usage=None):
+    for kind, value in (usage if usage is not None else memory_usage()).items():
+        WORKER_MEMORY_BYTES.labels(kind).set(value)
+
+
+def record_worker_startup(status):
+    WORKER_START_SECONDS.set(status['start_seconds'])
+    record_worker_memory(status['memory'])
+
+
+# /ready turns 200 once these have run in this worker. The face index quantizer is
+# trained per process, so its training starts here rather than in the gunicorn master,
+# and the job threads start here so queued jobs left by exited workers are picked up.
+startup_steps = [('faces', warm_up_faces), ('images', warm_up_images), ('face_index', train_face_index_if_needed)]
+if VERIFY_JOB_WORKERS_ENABLED:
+    startup_steps.append(('jobs', job_queue.start))
+worker_startup = WorkerStartup(startup_steps, on_ready=record_worker_startup)
+if VERIFY_PRELOAD and __name__ != '__main__':
+    # Imported by the gunicorn master: every forked worker warms itself up
+    os.register_at_fork(after_in_child=worker_startup.start)
+else:
+    worker_startup.start()
+
+
+def run_batch(items, concurrency=BATCH_CONCURRENCY, prefetch=BATCH_PREFETCH, limiter=batch_limiter,
+              admission_limit=BATCH_ADMISSION_MAX_IN_FLIGHT):
+    """Verify many payloads, yielding {'index', 'id', 'status_code', 'result'} as each one finishes.
+
+    Results are yielded in completion order. Downloads for the next `prefetch`
+    items run on their own threads while `concurrency` items are verified, so at
+    most concurrency + prefetch items hold decoded images at once. Each item
+    starts only after taking a slot from limiter (by default shared with every
+    other batch in the worker) and, unless admission_limit is None, an
+    admission slot while fewer than admission_limit verifications are running.
+    """
+    download_executor = ThreadPoolExecutor(max_workers=max(1, prefetch), thread_name_prefix='batch-download')
+    verify_executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='batch-verify')
+
+    def verify_item(index, item, download_future):
+        error = validate_verify_payload(item) if isinstance(item, dict) else 'Item must be an object'
+        if error:
+            return {'index': index, 'id': item.get('id') if isinstance(item, dict) else None,
+                    'status_code': 400, 'result': {'error': error}}
+        sources = download_future.result()
+        limiter.acquire()
+        memory_bytes = (len(selfie_frame_urls(item)) + 1) * DECODED_IMAGE_BYTES
+        if admission_limit is not None:
+            admission.admit_below(memory_bytes, admission_limit)
+        start = time.perf_counter()
+        try:
+            with IN_FLIGHT.labels('batch').track_inprogress(), memory_monitor.track('batch'):
+                body, status_code = run_verification(item, sources=sources, update_indexes=False)
+        finally:
+            if admission_limit is not None:
+                admission.release(memory_bytes, time.perf_counter() - start)
+        return {'index': index, 'id': item.get('id'), 'status_code': status_code, 'result': body}
+
+    def submit(index, item):
+        download_future = None
+        if isinstance(item, dict) and not validate_verify_payload(item):
+            download_future = download_executor.submit(download_images, selfie_frame_urls(item), item['id_photo_url'])
+        return verify_executor.submit(verify_item, index, item, download_future)
+
+    try:
+        items = enumerate(items)
+        in_flight = set()
+        for index, item in items:
+            in_flight.add(submit(index, item))
+            if len(in_flight) < concurrency + prefetch:
+                continue
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        for future in as_completed(in_flight):
+            yield future.result()
+    finally:
+        verify_executor.shutdown(wait=False, cancel_futures=True)
+        download_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def is_allowed_callback_url(url):
+    """Only allow http(s) callbacks to VERIFY_CALLBACK_ALLOWED_HOSTS, and only when they can be signed."""
+    if not VERIFY_CALLBACK_ALLOWED_HOSTS or not VERIFY_CALLBACK_SECRET:
+        return False
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        return False
+    return parsed.hostname.lower() in VERIFY_CALLBACK_ALLOWED_HOSTS
+
+
+@app.route('/verify', methods=['POST'])
+def verify():
+    """Main verification endpoint."""
+    try:
+        data = request.get_json(force=True, silent=False)
+    except Exception as json_err:
+        logger.error(f"JSON parsing error: {json_err}")
+        return jsonify({'error': f'Invalid JSON: {str(json_err)}'}), 400
+
+    error = validate_verify_payload(data)
+    if error:
+        return jsonify({'error': error}), 400
+
+    memory_bytes = (len(selfie_frame_urls(data)) + 1) * DECODED_IMAGE_BYTES
+    if not admission.try_admit(memory_bytes):
+        retry_after = admission.retry_after()
+        logger.warning(f"Verification rejected by admission control, retry after {retry_after}s")
+        response = jsonify({'error': 'Server is busy, retry later', 'retry_after': retry_after})
+        response.headers['Retry-After'] = str(retry_after)
+        return response, 429
+
+    start = time.perf_counter()
+    try:
+        deadline = request_deadline(request.headers.get('X-Verify-Deadline-Ms'))
+        with IN_FLIGHT.labels('verify').track_inprogress(), memory_monitor.track('verify'):
+            body, status_code = run_verification(data, deadline)
+    finally:
+        admission.release(memory_bytes, time.perf_counter() - start)
+    return jsonify(body), status_code
+
+
+def parse_point(point):
+    """Parse a {'lat', 'lng'} mapping into a float pair, or return None if invalid."""
+    try:
+        lat, lng = float(point['lat']), float(point['lng'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+
+@app.route('/districts/at-point', methods=['GET'])
+def districts_at_point():
+    """Return the federal, provincial and municipal districts containing ?lat=&lng=."""
+    if district_index is None:
+        return jsonify({'error': 'District boundaries not loaded'}), 503
+
+    point = parse_point(request.args)
+    if point is None:
+        return jsonify({'error': 'lat and lng query parameters are required'}), 400
+
+    return jsonify(district_index.at_point(*point)), 200
+
+
+@app.route('/districts/at-point/batch', methods=['POST'])
+def districts_at_point_batch():
+    """Resolve districts for many points, e.g. to backfill existing profiles."""
+    if district_index is None:
+        return jsonify({'error': 'District boundaries not loaded'}), 503
+
+    data = request.get_json(force=True, silent=True) or {}
+    points = data.get('points')
+    if not isinstance(points, list) or not points:
+        return jsonify({'error': 'points must be a non-empty list of {lat, lng}'}), 400
+    if len(points) > DISTRICTS_BATCH_MAX_POINTS:
+        return jsonify({'error': f'At most {DISTRICTS_BATCH_MAX_POINTS} points per batch'}), 400
+
+    parsed = [parse_point(point) if isinstance(point, dict) else None for point in points]
+    valid = [i for i, point in enumerate(parsed) if point is not None]
+    found = district_index.at_points(
+        [parsed[i][0] for i in valid],
+        [parsed[i][1] for i in valid]
+    )
+
+    results = [{'id': point.get('id') if isinstance(point, dict) else None, 'error': 'Invalid point'} for point in points]
+    for i, districts in zip(valid, found):
+        results[i] = {'id': points[i].get('id'), **districts}
+    return jsonify({'results': results}), 200
+
+
+@app.route('/verify/jobs', methods=['POST'])
+def submit_verify_job():
+    """Queue a verification and return a job id immediately."""
+    try:
+        data = request.get_json(force=True, silent=False)
+    except Exception as json_err:
+        logger.error(f"JSON parsing error: {json_err}")
+        return jsonify({'error': f'Invalid JSON: {str(json_err)}'}), 400
+
+    error = validate_verify_payload(data)
+    if error:
+        return jsonify({'error': error}), 400
+
+    callback_url = data.pop('callback_url', None)
+    if callback_url and not is_allowed_callback_url(callback_url):
+        return jsonify({'error': 'Invalid callback_url'}), 400
+
+    try:
+        job = job_queue.submit(data, callback_url=callback_url)
+    except QueueFullError:
+        logger.warning("Verification job queue is full")
+        response = jsonify({'error': 'Verification queue is full, retry later'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    logger.info(f"Queued verification job {job['job_id']}")
+    return jsonify({
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'status_url': f"/verify/jobs/{job['job_id']}"
+    }), 202
+
+
+@app.route('/verify/batch', methods=['POST'])
+def verify_batch():
+    """Verify many selfie/ID pairs and stream one NDJSON result line per item as it finishes."""
+    # Every item is a paid vision call, so batches are an admin operation
+    auth_error = admin_auth_error()
+    if auth_error:
+        return auth_error
+    data = request.get_json(force=True, silent=True) or {}
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'items must be a non-empty list of verification payloads'}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'At most {BATCH_MAX_ITEMS} items per batch'}), 400
+
+    logger.info(f"Starting batch verification of {len(items)} items")
+
+    def generate():
+        for result in run_batch(items):
+            yield json.dumps(result) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.route('/verify/jobs/<job_id>', methods=['GET'])
+def get_verify_job(job_id):
+    """Return the status, and result once finished, of a queued verification."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    return jsonify({
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at'],
+        'status_code': job.get('status_code'),
+        'result': job.get('result'),
+        'error': job.get('error')
+    }), 200
 
 
 if __name__ == '__main__':
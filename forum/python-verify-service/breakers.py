@@ -0,0 +1,161 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from deadline import DeadlineExceeded
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit is open."""
+
+
+class BulkheadFullError(Exception):
+    """Raised when no concurrency slot for a stage frees up in time."""
+
+
+class CircuitBreaker:
+    """Closed/open/half-open circuit breaker over a sliding window of recent calls.
+
+    A call counts as a failure when it raises or takes longer than slow_call_seconds.
+    Exceptions for which ignore(exc) is true are the caller's fault (e.g. a 404) and
+    count as successes, since the dependency did answer. DeadlineExceeded, and
+    `timeouts` exceptions raised before slow_call_seconds have passed, only mean the
+    caller's own deadline was short, and are not recorded at all. Once at least
+    min_calls are in the window and the failure rate reaches failure_rate, the
+    circuit opens for open_seconds; then up to half_open_probes calls are let
+    through, and the first probe result closes or re-opens it. on_failure, if given,
+    is called with 'error', 'slow' or 'circuit_open' for every failed or rejected call.
+    """
+
+    def __init__(self, name, failure_rate=0.5, slow_call_seconds=None, min_calls=10, window=20,
+                 open_seconds=30, half_open_probes=1, ignore=None, timeouts=(), on_failure=None):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.ignore = ignore or (lambda exc: False)
+        self.timeouts = timeouts
+        self.on_failure = on_failure or (lambda kind: None)
+        self._outcomes = deque(maxlen=window)
+        self._state = 'closed'
+        self._opened_at = 0.0
+        self._probes = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self._state == 'open' and time.monotonic() - self._opened_at >= self.open_seconds:
+                self._state, self._probes = 'half_open', 0
+            if self._state == 'closed':
+                return True
+            if self._state == 'half_open' and self._probes < self.half_open_probes:
+                self._probes += 1
+                return True
+            self._rejected += 1
+            return False
+
+    def record(self, success):
+        with self._lock:
+            if self._state == 'half_open':
+                if success:
+                    self._state = 'closed'
+                    self._outcomes.clear()
+                else:
+                    self._open()
+                return
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if (self._state == 'closed' and len(self._outcomes) >= self.min_calls
+                    and failures / len(self._outcomes) >= self.failure_rate):
+                self._open()
+
+    def _abandon(self):
+        """Give back a half-open probe slot whose call said nothing about the dependency."""
+        with self._lock:
+            if self._state == 'half_open' and self._probes > 0:
+                self._probes -= 1
+
+    def _caller_cut_short(self, exc, elapsed):
+        if isinstance(exc, DeadlineExceeded):
+            return True
+        return isinstance(exc, self.timeouts) and (self.slow_call_seconds is None or elapsed < self.slow_call_seconds)
+
+    def _open(self):
+        self._state = 'open'
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+
+    def call(self, fn, *args, **kwargs):
+        if not self.allow():
+            self.on_failure('circuit_open')
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        start = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if self._caller_cut_short(e, time.monotonic() - start):
+                self._abandon()
+            elif self.ignore(e):
+                self.record(True)
+            else:
+                self.record(False)
+                self.on_failure('error')
+            raise
+        slow = self.slow_call_seconds is not None and time.monotonic() - start > self.slow_call_seconds
+        if slow:
+            self.on_failure('slow')
+        self.record(not slow)
+        return result
+
+    def status(self):
+        with self._lock:
+            state = self._state
+            if state == 'open' and time.monotonic() - self._opened_at >= self.open_seconds:
+                state = 'half_open'
+            return {
+                'state': state,
+                'recent_calls': len(self._outcomes),
+                'recent_failures': self._outcomes.count(False),
+                'rejected': self._rejected,
+            }
+
+
+class Bulkhead:
+    """Concurrency limit for one stage, so a slow dependency cannot take every thread."""
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self._semaphore = threading.BoundedSemaphore(limit)
+        self._in_use = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self, timeout=None):
+        if not self._semaphore.acquire(timeout=timeout):
+            with self._lock:
+                self._rejected += 1
+            raise BulkheadFullError(f"{self.name} is at its concurrency limit of {self.limit}")
+        with self._lock:
+            self._in_use += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._semaphore.release()
+
+    def status(self):
+        with self._lock:
+            return {'limit': self.limit, 'in_use': self._in_use, 'rejected': self._rejected}
+
+
+def guarded_call(breaker, bulkhead, wait_seconds, fn, *args, **kwargs):
+    """Call fn through a bulkhead slot (waiting at most wait_seconds) and a circuit breaker."""
+    with bulkhead.acquire(wait_seconds):
+        return breaker.call(fn, *args, **kwargs)
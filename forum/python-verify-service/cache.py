@@ -0,0 +1,149 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(*parts):
+    """Build a cache key from a content digest and the stage parameters that affect the result."""
+    return hashlib.sha256('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU cache with a per-entry TTL."""
+
+    def __init__(self, max_entries=512, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl_seconds=None):
+        expires_at = time.time() + (ttl_seconds if ttl_seconds is not None else self.ttl_seconds)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """JSON-valued cache in a local SQLite file, shared by processes and surviving worker restarts."""
+
+    def __init__(self, path, ttl_seconds=86400, table='cache_entries'):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.table = table
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.table} (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        conn.execute(f'DELETE FROM {self.table} WHERE expires_at < ?', (time.time(),))
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # A connection opened before a fork (gunicorn preload) must not be used by the child
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        """Return (value, expires_at) for a live entry, or None."""
+        try:
+            row = self._connect().execute(
+                f'SELECT value, expires_at FROM {self.table} WHERE key = ?', (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Cache read from {self.path} failed: {e}")
+            return None
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, ttl_seconds=None):
+        expires_at = time.time() + (ttl_seconds if ttl_seconds is not None else self.ttl_seconds)
+        try:
+            self._connect().execute(
+                f'INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, json.dumps(value), expires_at)
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Cache write to {self.path} failed: {e}")
+
+
+class TieredCache:
+    """In-memory LRU in front of an optional SQLite tier, with hit/miss accounting."""
+
+    def __init__(self, name, memory, disk=None):
+        self.name = name
+        self.memory = memory
+        self.disk = disk
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, stat):
+        with self._stats_lock:
+            self._stats[stat] += 1
+        CACHE_LOOKUPS.labels(self.name, stat).inc()
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self._count('memory_hits')
+            return value
+        if self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                self._count('disk_hits')
+                # Keep the TTL the entry was written with (e.g. a short negative-result TTL)
+                self.memory.set(key, value, max(0.0, expires_at - time.time()))
+                return value
+        self._count('misses')
+        return None
+
+    def set(self, key, value, ttl_seconds=None):
+        self.memory.set(key, value, ttl_seconds)
+        if self.disk is not None:
+            self.disk.set(key, value, ttl_seconds)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((lookups - stats['misses']) / lookups, 3) if lookups else 0.0
+        stats['memory_entries'] = len(self.memory)
+        stats['disk_enabled'] = self.disk is not None
+        return stats
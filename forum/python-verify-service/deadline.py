@@ -0,0 +1,39 @@
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's time budget has run out before a call could start."""
+
+
+class Deadline:
+    """Absolute per-request deadline that hands each external call the time left."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout(self, cap=None):
+        """Seconds the next call may take: the time left, optionally capped.
+
+        Raises DeadlineExceeded instead of returning a zero timeout.
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Request deadline of {self.seconds}s exceeded")
+        return min(remaining, cap) if cap is not None else remaining
+
+
+def wait_for(future, deadline):
+    """Wait for a future until the deadline. Returns (result, timed_out)."""
+    try:
+        return future.result(timeout=deadline.remaining()), False
+    except FutureTimeoutError:
+        return None, True
@@ -0,0 +1,187 @@
+"""In-memory point-in-polygon district lookup.
+
+Boundaries are loaded once from GeoJSON FeatureCollections exported from the
+federal_districts, provincial_districts and municipal_districts tables, e.g.
+
+    ogr2ogr -f GeoJSON federal.geojson PG:"$DATABASE_URL" \
+        -sql "SELECT id, name_en, name_fr, geom FROM federal_districts"
+
+Polygons are packed into an STR tree of bounding boxes; candidate polygons
+are then tested exactly with a ray-casting test vectorized over edges and points.
+"""
+import json
+import logging
+import math
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DISTRICT_LEVELS = ('federal', 'provincial', 'municipal')
+
+# Upper bound on points x edges evaluated at once in a batch polygon test
+MAX_BATCH_CELLS = 4_000_000
+
+
+def points_in_ring(xs, ys, ring):
+    """Even-odd ray casting of many points against one closed ring of (x, y) vertices."""
+    x1, y1 = ring[:-1, 0], ring[:-1, 1]
+    x2, y2 = ring[1:, 0], ring[1:, 1]
+    px, py = xs[:, None], ys[:, None]
+    crosses = (y1 > py) != (y2 > py)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_at_y = (x2 - x1) * (py - y1) / (y2 - y1) + x1
+    return np.count_nonzero(crosses & (px < x_at_y), axis=1) % 2 == 1
+
+
+def points_in_polygon(xs, ys, rings):
+    """Test points against a polygon given as [exterior, hole, hole, ...] rings."""
+    inside = np.zeros(len(xs), dtype=bool)
+    chunk = max(1, MAX_BATCH_CELLS // max(len(rings[0]), 1))
+    for start in range(0, len(xs), chunk):
+        cx, cy = xs[start:start + chunk], ys[start:start + chunk]
+        result = points_in_ring(cx, cy, rings[0])
+        for hole in rings[1:]:
+            if result.any():
+                result &= ~points_in_ring(cx, cy, hole)
+        inside[start:start + chunk] = result
+    return inside
+
+
+def _polygon_parts(geometry):
+    if geometry is None:
+        return []
+    if geometry['type'] == 'Polygon':
+        polygons = [geometry['coordinates']]
+    elif geometry['type'] == 'MultiPolygon':
+        polygons = geometry['coordinates']
+    else:
+        return []
+    parts = []
+    for polygon in polygons:
+        rings = []
+        for ring in polygon:
+            ring = np.asarray(ring, dtype=np.float64)[:, :2]
+            if len(ring) < 3:
+                continue
+            if not np.array_equal(ring[0], ring[-1]):
+                ring = np.vstack([ring, ring[:1]])
+            rings.append(ring)
+        if rings:
+            parts.append(rings)
+    return parts
+
+
+class DistrictLayer:
+    """Districts for one level, indexed by an STR-packed tree of polygon bounding boxes."""
+
+    def __init__(self, level, features, node_capacity=16):
+        self.level = level
+        self.properties = []
+        self.part_feature = []
+        self.part_rings = []
+        for feature in features:
+            parts = _polygon_parts(feature.get('geometry'))
+            if not parts:
+                continue
+            self.properties.append(feature.get('properties') or {})
+            for rings in parts:
+                self.part_feature.append(len(self.properties) - 1)
+                self.part_rings.append(rings)
+
+        self.part_feature = np.asarray(self.part_feature, dtype=np.int32)
+        self.part_bboxes = np.array(
+            [[r[0][:, 0].min(), r[0][:, 1].min(), r[0][:, 0].max(), r[0][:, 1].max()] for r in self.part_rings],
+            dtype=np.float64
+        ).reshape(-1, 4)
+        self._build_str(node_capacity)
+
+    def _build_str(self, node_capacity):
+        """Sort-Tile-Recursive packing of the part bounding boxes into leaf nodes."""
+        count = len(self.part_bboxes)
+        leaf_count = max(1, math.ceil(count / node_capacity))
+        slice_count = max(1, math.ceil(math.sqrt(leaf_count)))
+        centers = (self.part_bboxes[:, :2] + self.part_bboxes[:, 2:]) / 2
+
+        by_x = np.argsort(centers[:, 0], kind='stable')
+        slice_size = slice_count * node_capacity
+        leaves = []
+        for start in range(0, count, slice_size):
+            in_slice = by_x[start:start + slice_size]
+            in_slice = in_slice[np.argsort(centers[in_slice, 1], kind='stable')]
+            for leaf_start in range(0, len(in_slice), node_capacity):
+                leaves.append(in_slice[leaf_start:leaf_start + node_capacity])
+
+        self.leaves = leaves
+        self.leaf_bboxes = np.array(
+            [[self.part_bboxes[leaf, 0].min(), self.part_bboxes[leaf, 1].min(),
+              self.part_bboxes[leaf, 2].max(), self.part_bboxes[leaf, 3].max()] for leaf in leaves],
+            dtype=np.float64
+        ).reshape(-1, 4)
+
+    def __len__(self):
+        return len(self.properties)
+
+    def locate(self, lngs, lats):
+        """Return the containing feature index for each point, or -1."""
+        result = np.full(len(lngs), -1, dtype=np.int64)
+        if len(self.leaves) == 0 or len(lngs) == 0:
+            return result
+
+        def in_boxes(boxes, xs, ys):
+            return ((xs[:, None] >= boxes[:, 0]) & (xs[:, None] <= boxes[:, 2]) &
+                    (ys[:, None] >= boxes[:, 1]) & (ys[:, None] <= boxes[:, 3]))
+
+        leaf_hits = in_boxes(self.leaf_bboxes, lngs, lats)
+        for leaf_index in np.flatnonzero(leaf_hits.any(axis=0)):
+            point_indexes = np.flatnonzero(leaf_hits[:, leaf_index] & (result == -1))
+            if len(point_indexes) == 0:
+                continue
+            parts = self.leaves[leaf_index]
+            part_hits = in_boxes(self.part_bboxes[parts], lngs[point_indexes], lats[point_indexes])
+            for column, part in enumerate(parts):
+                candidates = point_indexes[part_hits[:, column] & (result[point_indexes] == -1)]
+                if len(candidates) == 0:
+                    continue
+                inside = points_in_polygon(lngs[candidates], lats[candidates], self.part_rings[part])
+                result[candidates[inside]] = self.part_feature[part]
+        return result
+
+
+class DistrictIndex:
+    """Federal, provincial and municipal district layers loaded from a directory of GeoJSON files."""
+
+    def __init__(self, layers):
+        self.layers = layers
+
+    @classmethod
+    def load(cls, directory):
+        layers = {}
+        for level in DISTRICT_LEVELS:
+            path = os.path.join(directory, f'{level}.geojson')
+            if not os.path.exists(path):
+                logger.warning(f"No {level} district boundaries at {path}")
+                continue
+            with open(path, encoding='utf-8') as f:
+                collection = json.load(f)
+            layers[level] = DistrictLayer(level, collection.get('features', []))
+            logger.info(f"Loaded {len(layers[level])} {level} districts from {path}")
+        return cls(layers)
+
+    def sizes(self):
+        return {level: len(layer) for level, layer in self.layers.items()}
+
+    def at_points(self, lats, lngs):
+        """Return one {'federal': ..., 'provincial': ..., 'municipal': ...} dict per point."""
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        results = [{level: None for level in DISTRICT_LEVELS} for _ in range(len(lats))]
+        for level, layer in self.layers.items():
+            for i, feature_index in enumerate(layer.locate(lngs, lats)):
+                if feature_index >= 0:
+                    results[i][level] = layer.properties[feature_index]
+        return results
+
+    def at_point(self, lat, lng):
+        return self.at_points([lat], [lng])[0]
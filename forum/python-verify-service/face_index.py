@@ -0,0 +1,171 @@
+"""Append-only face embedding index, used to spot one face behind several accounts.
+
+Embeddings are stored as raw float32 rows in <path>.f32, with fixed-width
+subject ids in <path>.ids. Both files are appended under an exclusive flock
+and memory-mapped read-only, so every gunicorn worker searches the same
+page-cache copy and sees rows added by the others.
+
+Search is exhaustive by default: squared distances are computed chunk by chunk
+as |x|^2 - 2 x.q + |q|^2, one BLAS matrix-vector product per chunk, with row
+norms cached per process. Once trained, an optional coarse quantizer (k-means
+centroids) limits the search to the rows of the `nprobe` nearest clusters;
+rows appended after training are scanned exhaustively until the next training.
+"""
+import logging
+import os
+import threading
+
+import numpy as np
+
+from row_files import append_row, create_files, encode_id
+
+logger = logging.getLogger(__name__)
+
+ENCODING_DIM = 128
+SUBJECT_ID_BYTES = 64
+SEARCH_CHUNK_ROWS = 65536
+
+
+def kmeans(vectors, n_clusters, iterations=10, seed=0):
+    """Plain Lloyd's k-means; returns float32 centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        labels = nearest_centroids(vectors, centroids)
+        counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+def nearest_centroids(vectors, centroids):
+    """Index of the nearest centroid for each row, computed in chunks."""
+    centroid_norms = np.einsum('ij,ij->i', centroids, centroids)
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), SEARCH_CHUNK_ROWS):
+        block = np.asarray(vectors[start:start + SEARCH_CHUNK_ROWS], dtype=np.float32)
+        labels[start:start + len(block)] = np.argmin(centroid_norms - 2 * block @ centroids.T, axis=1)
+    return labels
+
+
+class FaceIndex:
+    def __init__(self, path, dim=ENCODING_DIM, nprobe=8):
+        self.dim = dim
+        self.nprobe = nprobe
+        self.vectors_path = f"{path}.f32"
+        self.ids_path = f"{path}.ids"
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._ids = np.zeros(0, dtype=f'S{SUBJECT_ID_BYTES}')
+        self._norms = np.zeros(0, dtype=np.float32)
+        self._lock = threading.Lock()
+        # Coarse quantizer: centroids, row indices grouped by cluster, and cluster offsets
+        self._centroids = None
+        self._order = None
+        self._offsets = None
+        self._trained_rows = 0
+        create_files(self.vectors_path, self.ids_path)
+
+    def __len__(self):
+        return len(self._refresh()[0])
+
+    def _refresh(self):
+        """Remap the files when other processes have appended rows; returns (vectors, ids, norms)."""
+        rows = min(os.path.getsize(self.vectors_path) // (self.dim * 4),
+                   os.path.getsize(self.ids_path) // SUBJECT_ID_BYTES)
+        with self._lock:
+            if rows != len(self._vectors):
+                vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(rows, self.dim)) \
+                    if rows else np.zeros((0, self.dim), dtype=np.float32)
+                ids = np.memmap(self.ids_path, dtype=f'S{SUBJECT_ID_BYTES}', mode='r', shape=(rows,)) \
+                    if rows else np.zeros(0, dtype=f'S{SUBJECT_ID_BYTES}')
+                known = min(len(self._norms), rows)
+                new = np.asarray(vectors[known:])
+                self._norms = np.concatenate([self._norms[:known], np.einsum('ij,ij->i', new, new)])
+                self._vectors, self._ids = vectors, ids
+            return self._vectors, self._ids, self._norms
+
+    def add(self, subject_id, encoding):
+        """Append one encoding for subject_id."""
+        row = np.asarray(encoding, dtype=np.float32).reshape(self.dim)
+        append_row(self.vectors_path, self.ids_path, row.tobytes(), encode_id(subject_id, SUBJECT_ID_BYTES))
+
+    def train(self, n_clusters, sample_per_cluster=40, seed=0):
+        """Fit the coarse quantizer on a sample of the current rows and assign every row to a cluster.
+
+        Takes seconds on a million rows, so it is meant to run off the request path.
+        """
+        vectors, _, _ = self._refresh()
+        rows = len(vectors)
+        if rows < n_clusters:
+            return False
+        rng = np.random.default_rng(seed)
+        sample_rows = rng.choice(rows, min(rows, n_clusters * sample_per_cluster), replace=False)
+        sample = np.asarray(vectors[np.sort(sample_rows)])
+        centroids = kmeans(sample, n_clusters, seed=seed)
+        labels = nearest_centroids(vectors, centroids)
+        order = np.argsort(labels, kind='stable').astype(np.int64)
+        offsets = np.searchsorted(labels[order], np.arange(n_clusters + 1))
+        with self._lock:
+            self._centroids, self._order, self._offsets, self._trained_rows = centroids, order, offsets, rows
+        logger.info(f"Face index quantizer trained: {rows} rows in {n_clusters} clusters")
+        return True
+
+    @property
+    def untrained_rows(self):
+        return len(self) - self._trained_rows
+
+    def _candidates(self, query, rows):
+        """Row indices to scan: the nearest clusters' rows plus rows added since training, or None for all."""
+        with self._lock:
+            centroids, order, offsets, trained = self._centroids, self._order, self._offsets, self._trained_rows
+        if centroids is None:
+            return None
+        distances = np.einsum('ij,ij->i', centroids, centroids) - 2 * centroids @ query
+        probe = np.argpartition(distances, min(self.nprobe, len(centroids)) - 1)[:self.nprobe]
+        parts = [order[offsets[c]:offsets[c + 1]] for c in probe]
+        parts.append(np.arange(trained, rows, dtype=np.int64))
+        return np.sort(np.concatenate(parts))
+
+    def search(self, encoding, max_distance, k=5, exclude_subject=None):
+        """Return up to k {'subject_id', 'distance'} matches within max_distance, nearest first."""
+        vectors, ids, norms = self._refresh()
+        if not len(vectors):
+            return []
+        query = np.asarray(encoding, dtype=np.float32).reshape(self.dim)
+        query_norm = float(query @ query)
+        limit = max_distance * max_distance
+        candidates = self._candidates(query, len(vectors))
+
+        found_rows, found_d2 = [], []
+        total = len(vectors) if candidates is None else len(candidates)
+        for start in range(0, total, SEARCH_CHUNK_ROWS):
+            if candidates is None:
+                end = min(total, start + SEARCH_CHUNK_ROWS)
+                d2 = norms[start:end] - 2 * (vectors[start:end] @ query) + query_norm
+                hits = np.flatnonzero(d2 <= limit)
+                found_rows.append(hits + start)
+            else:
+                rows = candidates[start:start + SEARCH_CHUNK_ROWS]
+                d2 = norms[rows] - 2 * (vectors[rows] @ query) + query_norm
+                hits = np.flatnonzero(d2 <= limit)
+                found_rows.append(rows[hits])
+            found_d2.append(d2[hits])
+
+        found_rows, found_d2 = np.concatenate(found_rows), np.concatenate(found_d2)
+        exclude = str(exclude_subject).encode('utf-8')[:SUBJECT_ID_BYTES] if exclude_subject else None
+        matches = []
+        for i in np.argsort(found_d2, kind='stable'):
+            subject = ids[found_rows[i]].rstrip(b'\0')
+            if exclude is not None and subject == exclude:
+                continue
+            if any(match['subject_id'] == subject.decode('utf-8', 'replace') for match in matches):
+                continue
+            matches.append({
+                'subject_id': subject.decode('utf-8', 'replace'),
+                'distance': round(float(np.sqrt(max(found_d2[i], 0.0))), 3)
+            })
+            if len(matches) >= k:
+                break
+        return matches
@@ -0,0 +1,126 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def share_array(array):
+    """Copy an array into a new shared memory block and return (shm, spec).
+
+    The spec is a small picklable tuple that lets another process map the
+    same buffer without the array itself being pickled.
+    """
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    view[...] = array
+    del view
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def attach_array(spec):
+    """Map a shared memory block described by share_array's spec as a numpy array."""
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+def _init_worker():
+    # Load the dlib models once for the lifetime of this process
+    logging.basicConfig(level=logging.INFO)
+    import faces
+    faces.load_models()
+    logger.info("Face inference process ready")
+
+
+def _detect_in_worker(spec):
+    import faces
+
+    shm, image = attach_array(spec)
+    try:
+        return faces.detect_faces(image)
+    finally:
+        del image
+        shm.close()
+
+
+def _encode_in_worker(spec, high_accuracy, max_faces, num_jitters, locations):
+    import faces
+
+    shm, image = attach_array(spec)
+    try:
+        return faces.encode_faces(image, high_accuracy, max_faces, num_jitters, locations)
+    finally:
+        # The array view must be dropped before the mapping can be closed
+        del image
+        shm.close()
+
+
+class FacePool:
+    """Fixed pool of face inference processes fed through shared memory.
+
+    The pool is created lazily on first use, and with the spawn or forkserver
+    start method, so it is never forked from a threaded gunicorn worker. With
+    forkserver the server process imports face_recognition, and so loads the
+    dlib models, once; the pool processes forked from it share those pages
+    copy-on-write instead of each loading their own copy.
+    """
+
+    def __init__(self, processes, start_method='spawn'):
+        self.processes = processes
+        self.start_method = start_method
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                logger.info(f"Starting face inference pool with {self.processes} processes ({self.start_method})")
+                context = multiprocessing.get_context(self.start_method)
+                if self.start_method == 'forkserver':
+                    context.set_forkserver_preload(['face_recognition'])
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=context,
+                    initializer=_init_worker
+                )
+            return self._executor
+
+    def _reset(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, fn, image, *args):
+        executor = self._get_executor()
+        shm, spec = share_array(image)
+        try:
+            return executor.submit(fn, spec, *args).result()
+        except BrokenProcessPool:
+            logger.error("Face inference pool crashed, restarting")
+            self._reset(executor)
+            raise
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def detect_faces(self, image):
+        """Run faces.detect_faces in a pool process and return the face boxes."""
+        return self._run(_detect_in_worker, image)
+
+    def encode_faces(self, image, high_accuracy=True, max_faces=None, num_jitters=None, locations=None):
+        """Run faces.encode_faces in a pool process and return its result dict."""
+        return self._run(_encode_in_worker, image, high_accuracy, max_faces, num_jitters, locations)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
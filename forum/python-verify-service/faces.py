@@ -0,0 +1,179 @@
+import logging
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+face_recognition = None
+
+# Longest side of the grayscale copies HOG detection runs on, smallest first.
+# Larger rungs are only tried when nothing is found; None is full resolution.
+DETECTION_LADDER = (640, 1280, None)
+
+# Padding around each detected face box, as a fraction of the box size, kept
+# in the crop passed to face_encodings so the landmark model sees the whole face
+CROP_PADDING = 0.5
+
+
+def load_models():
+    """Import face_recognition, which loads the dlib models into this process."""
+    global face_recognition
+    if face_recognition is None:
+        import face_recognition as loaded
+        face_recognition = loaded
+    return face_recognition
+
+
+def encoding_params(high_accuracy=True, num_jitters=None):
+    """Return the (model, num_jitters) pair used for face encoding."""
+    model, default_jitters = ('large', 5) if high_accuracy else ('small', 1)
+    return model, num_jitters if num_jitters is not None else default_jitters
+
+
+def detect_faces(image, ladder=DETECTION_LADDER):
+    """Detect faces on downscaled grayscale copies, climbing the ladder until one is found.
+
+    Returns face boxes as (top, right, bottom, left) in full-resolution coordinates.
+    """
+    load_models()
+    height, width = image.shape[:2]
+    gray = Image.fromarray(image).convert('L')
+
+    for max_side in ladder:
+        if max_side is None or max(height, width) <= max_side:
+            scale = 1.0
+            small = gray
+        else:
+            scale = max(height, width) / max_side
+            size = (max(1, round(width / scale)), max(1, round(height / scale)))
+            small = gray.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+        locations = face_recognition.face_locations(np.asarray(small), model='hog')
+        if locations:
+            logger.info(f"Detected {len(locations)} face(s) at {small.size[0]}x{small.size[1]}")
+            return [
+                (
+                    max(0, int(top * scale)),
+                    min(width, int(round(right * scale))),
+                    min(height, int(round(bottom * scale))),
+                    max(0, int(left * scale))
+                )
+                for top, right, bottom, left in locations
+            ]
+        if scale == 1.0:
+            break
+    return []
+
+
+def encode_face_crop(image, location, model, num_jitters):
+    """Encode one face from a padded crop around its box instead of the whole image."""
+    height, width = image.shape[:2]
+    top, right, bottom, left = location
+    pad = int(max(bottom - top, right - left) * CROP_PADDING)
+    y0, y1 = max(0, top - pad), min(height, bottom + pad)
+    x0, x1 = max(0, left - pad), min(width, right + pad)
+
+    crop = np.ascontiguousarray(image[y0:y1, x0:x1])
+    encodings = face_recognition.face_encodings(
+        crop,
+        known_face_locations=[(top - y0, right - x0, bottom - y0, left - x0)],
+        num_jitters=num_jitters,
+        model=model
+    )
+    return encodings[0] if encodings else None
+
+
+def encode_faces(image, high_accuracy=True, max_faces=None, num_jitters=None, locations=None):
+    """Detect and encode the faces in an image.
+
+    Returns {'face_count': n, 'encodings': [...]} with encodings as plain lists
+    so the result can be cached. Encoding is skipped when more than max_faces
+    faces are detected, since the caller will reject the image anyway.
+    Pass locations from an earlier detect_faces call to skip detection.
+    """
+    load_models()
+    model, num_jitters = encoding_params(high_accuracy, num_jitters)
+
+    if locations is None:
+        locations = detect_faces(image)
+    if not locations or (max_faces is not None and len(locations) > max_faces):
+        return {'face_count': len(locations), 'encodings': []}
+
+    logger.info(f"Face encoding with model={model}, num_jitters={num_jitters}")
+    encodings = []
+    for location in locations:
+        encoding = encode_face_crop(image, location, model, num_jitters)
+        if encoding is not None:
+            encodings.append(encoding.tolist())
+    return {'face_count': len(locations), 'encodings': encodings}
+
+
+def detection_failure(selfie_face_count, id_face_count):
+    """Return the rejection reason for face counts that can never produce a match, or None."""
+    if selfie_face_count == 0:
+        return 'No face detected in selfie'
+    if id_face_count == 0:
+        return 'No face detected in ID photo'
+    if selfie_face_count > 1:
+        return 'Multiple faces detected in selfie'
+    return None
+
+
+def compare_faces(selfie_faces, id_faces, high_accuracy=True):
+    """Compare encode_faces results for a selfie and an ID photo."""
+    failure = detection_failure(selfie_faces['face_count'], id_faces['face_count'])
+    if failure:
+        return {'success': False, 'reason': failure}
+
+    if len(selfie_faces['encodings']) == 0 or len(id_faces['encodings']) == 0:
+        return {'success': False, 'reason': 'Failed to encode detected faces'}
+
+    # Same Euclidean distance as face_recognition.face_distance
+    id_encodings = np.asarray(id_faces['encodings'])
+    selfie_encoding = np.asarray(selfie_faces['encodings'][0])
+    face_distance = np.linalg.norm(id_encodings - selfie_encoding, axis=1)
+    match_score = 1.0 - float(face_distance[0])
+
+    return {
+        'success': True,
+        'match_score': round(match_score, 3),
+        'reason': 'Faces compared successfully',
+        'accuracy_mode': 'high' if high_accuracy else 'standard',
+        'selfie_encoding': selfie_faces['encodings'][0]
+    }
+
+
+def compare_frames(frame_faces, id_faces, aggregation='median', best_k=3, high_accuracy=True):
+    """Compare encode_faces results for several selfie frames against an ID photo.
+
+    Frames without exactly one encoded face are dropped. The remaining encodings are
+    scored against the ID face in one vectorized distance computation and combined
+    with 'median' or 'best_k' (mean of the k best scores), so one bad frame cannot
+    decide the result.
+    """
+    usable = [faces['encodings'][0] for faces in frame_faces if faces['face_count'] == 1 and faces['encodings']]
+    if not usable:
+        failure = detection_failure(frame_faces[0]['face_count'], id_faces['face_count'])
+        return {'success': False, 'reason': failure or 'Failed to encode detected faces'}
+    if id_faces['face_count'] == 0:
+        return {'success': False, 'reason': 'No face detected in ID photo'}
+    if len(id_faces['encodings']) == 0:
+        return {'success': False, 'reason': 'Failed to encode detected faces'}
+
+    frame_encodings = np.asarray(usable)
+    scores = 1.0 - np.linalg.norm(frame_encodings - np.asarray(id_faces['encodings'][0]), axis=1)
+    if aggregation == 'best_k':
+        match_score = float(np.sort(scores)[::-1][:best_k].mean())
+    else:
+        match_score = float(np.median(scores))
+
+    return {
+        'success': True,
+        'match_score': round(match_score, 3),
+        'reason': 'Faces compared successfully',
+        'accuracy_mode': 'high' if high_accuracy else 'standard',
+        'frame_scores': [round(float(score), 3) for score in scores],
+        'frames_used': len(usable),
+        'selfie_encoding': usable[int(np.argmax(scores))]
+    }
@@ -0,0 +1,35 @@
+"""Gunicorn settings and hooks, loaded automatically from the working directory."""
+import gc
+import os
+import shutil
+
+# Samples left by a previous run would otherwise be aggregated into /metrics. This runs
+# when the config is loaded, before a preloaded app creates its metric files, and only
+# once per master so a config reload (HUP) does not delete the live workers' files.
+_metrics_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+if _metrics_dir and not os.environ.get('VERIFY_METRICS_DIR_CLEARED'):
+    shutil.rmtree(_metrics_dir, ignore_errors=True)
+    os.makedirs(_metrics_dir, exist_ok=True)
+    os.environ['VERIFY_METRICS_DIR_CLEARED'] = '1'
+
+# Import app.py once in the master and fork workers from it (see VERIFY_PRELOAD in app.py)
+preload_app = os.environ.get('VERIFY_PRELOAD', 'false').lower() in ('1', 'true', 'yes')
+
+# Recycle workers after this many requests, 0 to never recycle. Meant to go once the
+# memory reports (/admin/memory, MEMORY_REPORT_PATH) show RSS staying flat.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 0))
+
+
+def pre_fork(server, worker):
+    # Move everything the master imported out of the collector's reach, so collections
+    # in the workers do not write to (and un-share) those copy-on-write pages
+    if preload_app:
+        gc.freeze()
+
+
+def child_exit(server, worker):
+    # Drop the live gauges of recycled or crashed workers
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,174 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class HedgeCancelled(Exception):
+    """Raised inside a call that lost the race and stopped early."""
+
+
+class HedgeCancel:
+    """Set when a copy has lost the race.
+
+    Callbacks registered with on_cancel, such as closing the copy's response, run
+    on the winning side as soon as it is set, so a loser blocked on its next read
+    is stopped instead of holding its connection until the read returns.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def is_set(self):
+        return self._event.is_set()
+
+    def set(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._call(callback)
+
+    def on_cancel(self, callback):
+        """Run callback when the copy is cancelled, or right away if it already was."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        self._call(callback)
+
+    @staticmethod
+    def _call(callback):
+        try:
+            callback()
+        except Exception as e:
+            logger.debug(f"Hedge cancel callback failed: {e}")
+
+
+class HedgeBudget:
+    """Sliding one-minute window capping how many hedge calls may be fired."""
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self._fired = deque()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._fired and now - self._fired[0] > 60:
+                self._fired.popleft()
+            if len(self._fired) >= self.per_minute:
+                return False
+            self._fired.append(now)
+            return True
+
+
+class Hedger:
+    """Run a call and, if it is slower than a percentile of recent latency, race a second copy.
+
+    `fn` receives a HedgeCancel that is set when its copy has lost; it should
+    register a callback that closes its connection. The first copy to succeed
+    wins; when one copy fails the other is still awaited. Every run needs up to
+    two executor threads, so size max_workers to at least twice the number of
+    concurrent runs, or primaries queue behind other calls' hedges and losers.
+    """
+
+    def __init__(self, percentile=95, min_delay=1.0, per_minute=10, window=200, min_samples=20, max_workers=8):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.budget = HedgeBudget(per_minute)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hedge')
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._counts = {'calls': 0, 'hedged': 0, 'primary_wins': 0, 'hedge_wins': 0, 'budget_exhausted': 0}
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, or None until enough latencies have been observed."""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = np.fromiter(self._latencies, dtype=np.float64)
+        return max(self.min_delay, float(np.percentile(latencies, self.percentile)))
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def _timed(self, fn, cancelled):
+        start = time.monotonic()
+        result = fn(cancelled)
+        with self._lock:
+            self._latencies.append(time.monotonic() - start)
+        return result
+
+    def run(self, fn, timeout=None):
+        """Return fn's result, hedging it once if it runs past the hedge delay.
+
+        Raises TimeoutError when no copy succeeds within timeout seconds.
+        """
+        self._count('calls')
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        cancels = {}
+
+        primary_cancel = HedgeCancel()
+        primary = self.executor.submit(self._timed, fn, primary_cancel)
+        cancels[primary] = primary_cancel
+
+        delay = self.hedge_delay()
+        if delay is not None:
+            if timeout is not None:
+                delay = min(delay, timeout)
+            wait([primary], timeout=delay)
+            if not primary.done() and (deadline is None or time.monotonic() < deadline):
+                if self.budget.try_acquire():
+                    self._count('hedged')
+                    hedge_cancel = HedgeCancel()
+                    hedge = self.executor.submit(self._timed, fn, hedge_cancel)
+                    cancels[hedge] = hedge_cancel
+                else:
+                    self._count('budget_exhausted')
+
+        pending = set(cancels)
+        error = None
+        while pending:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        cancels[loser].set()
+                        loser.cancel()
+                    if len(cancels) > 1:
+                        self._count('primary_wins' if future is primary else 'hedge_wins')
+                    return future.result()
+                error = future.exception()
+
+        for future in pending:
+            cancels[future].set()
+            future.cancel()
+        if error is not None and not pending:
+            raise error
+        raise TimeoutError(f"No response within {timeout}s")
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+            samples = len(self._latencies)
+        counts['hedge_rate'] = round(counts['hedged'] / counts['calls'], 4) if counts['calls'] else 0.0
+        counts['latency_samples'] = samples
+        delay = self.hedge_delay()
+        counts['hedge_delay_ms'] = round(delay * 1000, 1) if delay is not None else None
+        return counts
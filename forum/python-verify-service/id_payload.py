@@ -0,0 +1,142 @@
+import base64
+import math
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from images import ImageSource
+from quality import downscaled_gray
+
+# Image settings sent to the vision model per id_type. In 'high' detail the model
+# bills 85 tokens plus 170 per 512px tile, and never looks at more than 768px on
+# the short side; 'low' detail is a flat 85 tokens at up to 512px.
+# A RAMQ card has large printed names and needs only 'low' detail; the small
+# address block on a driver's license needs the most resolution.
+ID_PAYLOAD_PROFILES = {
+    'medical_card': {'detail': 'low', 'max_tiles': 1, 'quality': 80},
+    'passport': {'detail': 'high', 'max_tiles': 2, 'quality': 85},
+    'drivers_license': {'detail': 'high', 'max_tiles': 4, 'quality': 90},
+}
+TILE_SIZE = 512
+HIGH_DETAIL_MAX_SHORT_SIDE = 768
+
+# Share of the edge energy, per axis, that the card crop must contain
+CARD_EDGE_COVERAGE = 0.98
+CARD_CROP_MARGIN = 0.04
+# Skip cropping when the detected card already fills this much of the photo
+CARD_MIN_SAVINGS = 0.9
+
+
+def locate_card(image):
+    """Estimate the ID card's bounding box (top, right, bottom, left) from edge density.
+
+    Plain backgrounds around the card carry little gradient energy, so the box
+    spanning the central CARD_EDGE_COVERAGE of edge energy along each axis is
+    a cheap card estimate. Returns None when cropping would not help.
+    """
+    height, width = image.shape[:2]
+    gray = downscaled_gray(image, max_side=256)
+    magnitude = np.abs(np.diff(gray, axis=1))[:-1, :] + np.abs(np.diff(gray, axis=0))[:, :-1]
+    total = magnitude.sum()
+    if total <= 0:
+        return None
+
+    tail = (1 - CARD_EDGE_COVERAGE) / 2
+    bounds = []
+    for axis in (1, 0):
+        cumulative = np.cumsum(magnitude.sum(axis=axis)) / total
+        low = int(np.searchsorted(cumulative, tail))
+        high = int(np.searchsorted(cumulative, 1 - tail)) + 1
+        bounds.append((low / len(cumulative), high / len(cumulative)))
+    (top, bottom), (left, right) = bounds
+
+    top, bottom = max(0.0, top - CARD_CROP_MARGIN), min(1.0, bottom + CARD_CROP_MARGIN)
+    left, right = max(0.0, left - CARD_CROP_MARGIN), min(1.0, right + CARD_CROP_MARGIN)
+    if (bottom - top) * (right - left) > CARD_MIN_SAVINGS:
+        return None
+    return int(top * height), int(math.ceil(right * width)), int(math.ceil(bottom * height)), int(left * width)
+
+
+def estimate_image_tokens(width, height, detail):
+    """Estimate vision input tokens for an image, following OpenAI's tiling rules."""
+    if detail == 'low':
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, HIGH_DETAIL_MAX_SHORT_SIDE / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+
+
+def fit_to_tiles(width, height, max_tiles):
+    """Return the largest (width, height) that fits a grid of at most max_tiles 512px tiles.
+
+    Resolution the model would discard anyway (above 768px on the short side) is
+    never kept, and ties go to the grid with fewer tiles.
+    """
+    best_scale, best_tiles = 0.0, None
+    for cols in range(1, max_tiles + 1):
+        for rows in range(1, max_tiles // cols + 1):
+            scale = min(
+                1.0,
+                cols * TILE_SIZE / width,
+                rows * TILE_SIZE / height,
+                HIGH_DETAIL_MAX_SHORT_SIDE / min(width, height)
+            )
+            if scale > best_scale + 1e-9 or (abs(scale - best_scale) <= 1e-9 and cols * rows < best_tiles):
+                best_scale, best_tiles = scale, cols * rows
+    return max(1, int(width * best_scale)), max(1, int(height * best_scale))
+
+
+def prepare_id_payload(image, id_type):
+    """Crop, resize and JPEG-encode an ID image for the vision model.
+
+    Accepts an ImageSource, a PIL image or an RGB numpy array and returns a dict
+    with the base64 payload, the detail level and size stats for logging. The
+    original JPEG bytes of an ImageSource are sent as-is when no crop, rotation
+    or resize is needed.
+    """
+    profile = ID_PAYLOAD_PROFILES.get(id_type, ID_PAYLOAD_PROFILES['drivers_license'])
+    source = image if isinstance(image, ImageSource) else None
+    if source is not None:
+        array = source.array
+    else:
+        array = image if isinstance(image, np.ndarray) else np.asarray(image)
+
+    box = locate_card(array)
+    if box is not None:
+        top, right, bottom, left = box
+        # A slice is a view; only the cropped region is copied into the PIL image below
+        array = array[top:bottom, left:right]
+    size = (array.shape[1], array.shape[0])
+
+    if profile['detail'] == 'low':
+        ratio = min(1.0, TILE_SIZE / max(size))
+        new_size = tuple(max(1, int(dim * ratio)) for dim in size)
+    else:
+        new_size = fit_to_tiles(*size, profile['max_tiles'])
+
+    reencoded = not (
+        source is not None and box is None and source.is_upright_jpeg
+        and source.original_size == size and new_size == size
+    )
+    if reencoded:
+        pil_image = Image.fromarray(array)
+        if new_size != size:
+            pil_image = pil_image.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        buffered = BytesIO()
+        pil_image.save(buffered, format='JPEG', quality=profile['quality'])
+        data = buffered.getvalue()
+    else:
+        data = source.data
+
+    return {
+        'base64': base64.b64encode(data).decode('utf-8'),
+        'detail': profile['detail'],
+        'bytes': len(data),
+        'size': new_size,
+        'cropped': box is not None,
+        'reencoded': reencoded,
+        'estimated_tokens': estimate_image_tokens(*new_size, profile['detail']),
+    }
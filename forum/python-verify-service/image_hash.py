@@ -0,0 +1,146 @@
+"""Perceptual hashes of ID photos and an index for near-duplicate lookups.
+
+The 64-bit pHash is taken over the card region (see id_payload.locate_card), so
+the same card photographed on another background, lightly cropped or
+re-compressed lands within a few bits of the original.
+
+The index appends hashes to <path>.u64 and fixed-width record ids to <path>.ids
+under an flock (see row_files), like face_index, and memory-maps both. Lookups use multi-index
+hashing: each hash is split into four 16-bit chunks, and by pigeonhole any
+hash within Hamming distance 7 is within one bit of the query in at least one
+chunk, so binary searches for those 17 chunk values in per-chunk sorted tables
+give the candidates. Larger radii, and rows appended since the tables were
+built, fall back to a vectorized popcount scan.
+"""
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+from id_payload import locate_card
+from row_files import append_row, create_files, encode_id
+
+RECORD_ID_BYTES = 64
+CHUNKS = 4
+CHUNK_BITS = 16
+# Rows appended since the chunk tables were built that are scanned before rebuilding
+MAX_TAIL_ROWS = 4096
+
+HASH_SIZE = 8
+DCT_SIZE = 32
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+
+DCT_MATRIX = _dct_matrix(DCT_SIZE)
+BIT_WEIGHTS = np.uint64(1) << np.arange(HASH_SIZE * HASH_SIZE, dtype=np.uint64)
+
+_BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount64(values):
+    """Set bits per uint64 value."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    return _BYTE_POPCOUNT[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def phash(image):
+    """64-bit DCT perceptual hash of the ID card region of an RGB array."""
+    box = locate_card(image)
+    if box is not None:
+        top, right, bottom, left = box
+        image = image[top:bottom, left:right]
+    gray = Image.fromarray(image).convert('L').resize((DCT_SIZE, DCT_SIZE), Image.Resampling.BOX)
+    pixels = np.asarray(gray, dtype=np.float32)
+    low = (DCT_MATRIX @ pixels @ DCT_MATRIX.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    # The DC term only carries overall brightness, so it is left out of the median
+    bits = low > np.median(low[1:])
+    return int(BIT_WEIGHTS[bits].sum())
+
+
+class ImageHashIndex:
+    def __init__(self, path):
+        self.hashes_path = f"{path}.u64"
+        self.ids_path = f"{path}.ids"
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        self._ids = np.zeros(0, dtype=f'S{RECORD_ID_BYTES}')
+        self._tables = None
+        self._table_rows = 0
+        self._lock = threading.Lock()
+        create_files(self.hashes_path, self.ids_path)
+
+    def __len__(self):
+        return len(self._refresh()[0])
+
+    def _refresh(self):
+        """Remap when rows were appended and rebuild the chunk tables once the unindexed tail grows."""
+        rows = min(os.path.getsize(self.hashes_path) // 8, os.path.getsize(self.ids_path) // RECORD_ID_BYTES)
+        with self._lock:
+            if rows != len(self._hashes):
+                self._hashes = np.memmap(self.hashes_path, dtype=np.uint64, mode='r', shape=(rows,)) \
+                    if rows else np.zeros(0, dtype=np.uint64)
+                self._ids = np.memmap(self.ids_path, dtype=f'S{RECORD_ID_BYTES}', mode='r', shape=(rows,)) \
+                    if rows else np.zeros(0, dtype=f'S{RECORD_ID_BYTES}')
+            if rows - self._table_rows > MAX_TAIL_ROWS:
+                self._tables = self._build_tables(np.asarray(self._hashes))
+                self._table_rows = rows
+            return self._hashes, self._ids, self._tables, self._table_rows
+
+    @staticmethod
+    def _build_tables(hashes):
+        """Per chunk, (sorted chunk values, row order)."""
+        tables = []
+        for chunk in range(CHUNKS):
+            values = ((hashes >> np.uint64(chunk * CHUNK_BITS)) & np.uint64(0xFFFF)).astype(np.uint16)
+            order = np.argsort(values, kind='stable')
+            tables.append((values[order], order))
+        return tables
+
+    def add(self, record_id, value):
+        """Append one hash for record_id."""
+        append_row(self.hashes_path, self.ids_path, np.uint64(value).tobytes(), encode_id(record_id, RECORD_ID_BYTES))
+
+    def search(self, value, max_distance, k=5, exclude_record=None):
+        """Return up to k {'record_id', 'distance'} hashes within max_distance bits, nearest first."""
+        hashes, ids, tables, table_rows = self._refresh()
+        if not len(hashes):
+            return []
+        query = np.uint64(value)
+
+        if tables is not None and max_distance < 2 * CHUNKS:
+            parts = []
+            for chunk, (values, order) in enumerate(tables):
+                key = (int(value) >> (chunk * CHUNK_BITS)) & 0xFFFF
+                keys = np.array([key], dtype=np.uint16)
+                if max_distance >= CHUNKS:
+                    keys = np.concatenate([keys, key ^ (np.uint16(1) << np.arange(CHUNK_BITS, dtype=np.uint16))])
+                lows, highs = np.searchsorted(values, keys, 'left'), np.searchsorted(values, keys, 'right')
+                parts.extend(order[low:high] for low, high in zip(lows, highs))
+            parts.append(np.arange(table_rows, len(hashes)))
+            rows = np.unique(np.concatenate(parts))
+            distances = popcount64(np.asarray(hashes[rows]) ^ query)
+        else:
+            rows = np.arange(len(hashes))
+            distances = popcount64(np.asarray(hashes) ^ query)
+
+        hits = np.flatnonzero(distances <= max_distance)
+        exclude = str(exclude_record).encode('utf-8')[:RECORD_ID_BYTES] if exclude_record else None
+        matches = []
+        for i in hits[np.argsort(distances[hits], kind='stable')]:
+            record = ids[rows[i]].rstrip(b'\0')
+            if exclude is not None and record == exclude:
+                continue
+            record = record.decode('utf-8', 'replace')
+            if any(match['record_id'] == record for match in matches):
+                continue
+            matches.append({'record_id': record, 'distance': int(distances[i])})
+            if len(matches) >= k:
+                break
+        return matches
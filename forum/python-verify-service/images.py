@@ -0,0 +1,82 @@
+import hashlib
+import logging
+import threading
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# JPEG draft decoding may land slightly below max_dimension (e.g. 4032px -> 2016px)
+JPEG_DRAFT_TOLERANCE = 0.95
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+def decode_image(data, max_dimension=2048):
+    """Decode image bytes to an upright RGB PIL image no larger than max_dimension."""
+    image = Image.open(BytesIO(data))
+
+    if image.format == 'JPEG':
+        # Let libjpeg decode at 1/2, 1/4 or 1/8 scale in the DCT instead of
+        # decoding every pixel and throwing most of them away when resizing
+        target = int(max_dimension * JPEG_DRAFT_TOLERANCE)
+        ratio = target / max(image.size)
+        if ratio < 1:
+            image.draft('RGB', (max(1, int(image.size[0] * ratio)), max(1, int(image.size[1] * ratio))))
+
+    # Phone photos are usually stored sideways with an EXIF orientation tag
+    image = ImageOps.exif_transpose(image)
+
+    if max(image.size) > max_dimension:
+        ratio = max_dimension / max(image.size)
+        new_size = tuple(int(dim * ratio) for dim in image.size)
+        image = image.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        logger.info(f"Resized image to {new_size}")
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+
+class ImageSource:
+    """Original downloaded bytes alongside a lazily decoded RGB array.
+
+    Consumers take whichever representation they need: the OpenAI payload can
+    reuse the original JPEG bytes, face matching and the quality gate share one
+    decoded array, and nothing is decoded or re-encoded twice.
+    """
+
+    def __init__(self, data, max_dimension=2048):
+        self.data = data
+        self.max_dimension = max_dimension
+        self.digest = hashlib.sha256(data).hexdigest()
+        self._array = None
+        self._lock = threading.Lock()
+
+        # Only the header is parsed here; pixel data is decoded on first use
+        header = Image.open(BytesIO(data))
+        self.format = header.format
+        self.original_size = header.size
+        self.orientation = header.getexif().get(EXIF_ORIENTATION_TAG, 1)
+
+    @property
+    def array(self):
+        """Decoded, upright, resized RGB array (read-only; decoded once and shared)."""
+        if self._array is None:
+            with self._lock:
+                if self._array is None:
+                    # np.asarray wraps Pillow's exported buffer instead of copying it again
+                    self._array = np.asarray(decode_image(self.data, self.max_dimension))
+        return self._array
+
+    @property
+    def is_upright_jpeg(self):
+        """True when the original bytes are a JPEG that needs no EXIF rotation."""
+        return self.format == 'JPEG' and self.orientation in (None, 1)
+
+    def release(self):
+        """Drop the decoded array; the original bytes stay available."""
+        with self._lock:
+            self._array = None
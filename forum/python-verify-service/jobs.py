@@ -0,0 +1,360 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue has no room for another job."""
+
+
+class MemoryJobStore:
+    """In-process job store. Only suitable for a single gunicorn worker or tests.
+
+    Jobs not updated for ttl_seconds are expired: get and claim no longer return
+    them, and purge_expired deletes them.
+    """
+
+    def __init__(self, ttl_seconds=3600):
+        self.ttl_seconds = ttl_seconds
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job):
+        with self._lock:
+            self._jobs[job['job_id']] = dict(job, attempts=0, lease_expires_at=None)
+
+    def claim(self, lease_seconds):
+        """Mark the oldest queued job, or running job whose lease expired, as running and return it."""
+        now = time.time()
+        cutoff = now - self.ttl_seconds
+        with self._lock:
+            claimable = [
+                job for job in self._jobs.values()
+                if job['updated_at'] >= cutoff and (
+                    job['status'] == 'queued' or (job['status'] == 'running' and job['lease_expires_at'] < now)
+                )
+            ]
+            if not claimable:
+                return None
+            job = min(claimable, key=lambda job: job['created_at'])
+            job.update(status='running', lease_expires_at=now + lease_seconds, attempts=job['attempts'] + 1,
+                       updated_at=now)
+            return dict(job)
+
+    def count_queued(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job['status'] == 'queued')
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['updated_at'] < time.time() - self.ttl_seconds:
+                return None
+            return dict(job)
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields, updated_at=time.time())
+
+    def purge_expired(self):
+        """Delete expired jobs and return how many were deleted."""
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items() if job['updated_at'] < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+        return len(expired)
+
+
+class SQLiteJobStore:
+    """SQLite-backed job store so every gunicorn worker can answer status polls.
+
+    Expiry works as in MemoryJobStore. Connections use secure_delete, so purged
+    payloads and results are overwritten in the database file, not just unlinked.
+    """
+
+    def __init__(self, path, ttl_seconds=3600):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS verify_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    payload TEXT,
+                    callback_url TEXT,
+                    result TEXT,
+                    status_code INTEGER,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    lease_expires_at REAL
+                )
+            """)
+            # Job stores created before leases were added
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(verify_jobs)')}
+            if 'attempts' not in columns:
+                conn.execute('ALTER TABLE verify_jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0')
+            if 'lease_expires_at' not in columns:
+                conn.execute('ALTER TABLE verify_jobs ADD COLUMN lease_expires_at REAL')
+            conn.execute('CREATE INDEX IF NOT EXISTS verify_jobs_status ON verify_jobs (status, created_at)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # A connection opened before a fork (gunicorn preload) must not be used by the child
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA secure_delete=ON')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def create(self, job):
+        self._connect().execute(
+            'INSERT INTO verify_jobs (job_id, status, payload, callback_url, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (job['job_id'], job['status'], json.dumps(job['payload']), job.get('callback_url'),
+             job['created_at'], job['updated_at'])
+        )
+
+    def get(self, job_id):
+        row = self._connect().execute(
+            'SELECT * FROM verify_jobs WHERE job_id = ? AND updated_at >= ?', (job_id, time.time() - self.ttl_seconds)
+        ).fetchone()
+        return self._decode(row) if row is not None else None
+
+    def purge_expired(self):
+        """Delete expired jobs and return how many were deleted."""
+        cursor = self._connect().execute(
+            'DELETE FROM verify_jobs WHERE updated_at < ?', (time.time() - self.ttl_seconds,)
+        )
+        return cursor.rowcount
+
+    @staticmethod
+    def _decode(row):
+        job = dict(row)
+        job['payload'] = json.loads(job['payload']) if job['payload'] else None
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def claim(self, lease_seconds):
+        """Mark the oldest queued job, or running job whose lease expired, as running and return it.
+
+        BEGIN IMMEDIATE takes the write lock before the select, so two gunicorn
+        workers can never claim the same job.
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                "SELECT * FROM verify_jobs WHERE (status = 'queued' "
+                "OR (status = 'running' AND (lease_expires_at IS NULL OR lease_expires_at < ?))) "
+                "AND updated_at >= ? ORDER BY created_at LIMIT 1",
+                (now, now - self.ttl_seconds)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE verify_jobs SET status = 'running', lease_expires_at = ?, attempts = attempts + 1, "
+                    "updated_at = ? WHERE job_id = ?",
+                    (now + lease_seconds, now, row['job_id'])
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        job = self._decode(row)
+        job.update(status='running', attempts=job['attempts'] + 1, lease_expires_at=now + lease_seconds)
+        return job
+
+    def count_queued(self):
+        return self._connect().execute("SELECT COUNT(*) FROM verify_jobs WHERE status = 'queued'").fetchone()[0]
+
+    def update(self, job_id, **fields):
+        if 'result' in fields:
+            fields['result'] = json.dumps(fields['result'])
+        fields['updated_at'] = time.time()
+        columns = ', '.join(f'{key} = ?' for key in fields)
+        self._connect().execute(
+            f'UPDATE verify_jobs SET {columns} WHERE job_id = ?',
+            (*fields.values(), job_id)
+        )
+
+
+class JobQueue:
+    """Job queue drained by a dedicated pool of worker threads in every gunicorn worker.
+
+    `handler` receives the job payload and returns a (body, status_code) tuple,
+    the same shape the synchronous /verify endpoint produces. Threads claim jobs
+    from the store under a lease of lease_seconds, so with the SQLite store a job
+    whose gunicorn worker was recycled or crashed is picked up by another worker
+    once its lease runs out. A job claimed more than max_attempts times is failed
+    (and its callback sent) instead of being run again.
+
+    Every purge_seconds one thread per process deletes expired jobs from the
+    store, so their payloads and results do not outlive the store's TTL.
+
+    Callback bodies are signed with callback_secret: X-Verify-Signature is
+    "sha256=" + the hex HMAC-SHA256 of "<X-Verify-Timestamp>.<body>", so the
+    receiver can reject forged and replayed callbacks.
+    """
+
+    def __init__(self, handler, store, workers=2, max_pending=64, lease_seconds=300, max_attempts=2,
+                 poll_seconds=1.0, purge_seconds=60, callback_secret=None, callback_timeout=10, callback_retries=3):
+        self.handler = handler
+        self.store = store
+        self.workers = workers
+        self.max_pending = max_pending
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+        self.purge_seconds = purge_seconds
+        self.callback_secret = callback_secret
+        self.callback_timeout = callback_timeout
+        self.callback_retries = callback_retries
+        self._wake = threading.Event()
+        self._threads = []
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Start the worker threads in this process, if they are not running yet."""
+        # Threads are started lazily, and again after a fork, so nothing runs in a
+        # gunicorn master on behalf of its workers
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._threads = []
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f'verify-job-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            if self.purge_seconds > 0:
+                thread = threading.Thread(target=self._purge_loop, name='verify-job-purge', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._pid = os.getpid()
+
+    def submit(self, payload, callback_url=None):
+        self.start()
+        if self.store.count_queued() >= self.max_pending:
+            raise QueueFullError('Job queue is full')
+        now = time.time()
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'status': 'queued',
+            'payload': payload,
+            'callback_url': callback_url,
+            'created_at': now,
+            'updated_at': now,
+        }
+        self.store.create(job)
+        self._wake.set()
+        return job
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def pending(self):
+        return self.store.count_queued()
+
+    def _worker(self):
+        while True:
+            try:
+                job = self.store.claim(self.lease_seconds)
+            except Exception as e:
+                logger.error(f"Claiming a job failed: {e}")
+                job = None
+            if job is None:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+                continue
+            try:
+                self._run(job)
+            except Exception as e:
+                logger.error(f"Job {job['job_id']} crashed: {e}")
+
+    def _purge_loop(self):
+        while True:
+            try:
+                purged = self.store.purge_expired()
+                if purged:
+                    logger.info(f"Purged {purged} expired jobs")
+            except Exception as e:
+                logger.error(f"Purging expired jobs failed: {e}")
+            time.sleep(self.purge_seconds)
+
+    def _run(self, job):
+        job_id = job['job_id']
+        if job['attempts'] > self.max_attempts:
+            logger.error(f"Job {job_id} was abandoned {job['attempts'] - 1} times, failing it")
+            error = 'Worker exited before the job finished'
+            body, status_code, status = {'error': error}, 500, 'failed'
+            self.store.update(job_id, status=status, result=body, status_code=status_code, error=error)
+        else:
+            if job['attempts'] > 1:
+                logger.warning(f"Job {job_id} resumed after its worker exited (attempt {job['attempts']})")
+            try:
+                body, status_code = self.handler(job['payload'])
+                status = 'succeeded' if status_code < 400 else 'failed'
+                self.store.update(job_id, status=status, result=body, status_code=status_code)
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {e}")
+                body, status_code, status = {'error': f'Internal error: {str(e)}'}, 500, 'failed'
+                self.store.update(job_id, status=status, result=body, status_code=status_code, error=str(e))
+        logger.info(f"Job {job_id} finished with status {status}")
+
+        if job.get('callback_url'):
+            self._send_callback(job['callback_url'], {
+                'job_id': job_id,
+                'status': status,
+                'status_code': status_code,
+                'result': body,
+            })
+
+    def sign_callback(self, body, timestamp):
+        message = f"{timestamp}.".encode('utf-8') + body
+        return 'sha256=' + hmac.new(self.callback_secret.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+    def _send_callback(self, url, payload):
+        if not self.callback_secret:
+            logger.error(f"Not sending callback to {url}: no callback secret is configured")
+            return False
+        body = json.dumps(payload).encode('utf-8')
+        for attempt in range(1, self.callback_retries + 1):
+            timestamp = str(int(time.time()))
+            headers = {
+                'Content-Type': 'application/json',
+                'X-Verify-Timestamp': timestamp,
+                'X-Verify-Signature': self.sign_callback(body, timestamp),
+            }
+            try:
+                # Redirects are not followed: they could lead off the allowed hosts
+                response = requests.post(url, data=body, headers=headers, timeout=self.callback_timeout,
+                                         allow_redirects=False)
+                response.raise_for_status()
+                return True
+            except Exception as e:
+                logger.warning(f"Callback to {url} failed (attempt {attempt}/{self.callback_retries}): {e}")
+                if attempt < self.callback_retries:
+                    time.sleep(2 ** attempt)
+        return False
@@ -0,0 +1,231 @@
+"""Memory-growth instrumentation for one gunicorn worker.
+
+MemoryMonitor records the RSS change across every tracked verification, and
+every report_interval seconds writes a report (as one JSON line, appended to
+report_path) with current memory, garbage collector and Pillow arena stats.
+Once the file would grow past report_max_bytes it is rotated to report_path.1,
+replacing the previous one.
+
+With tracemalloc_frames > 0 it also traces Python allocations and diffs each
+periodic snapshot against the previous one and against the first, grouped by
+allocation site, so steady growth shows up as the same sites climbing between
+reports. numpy registers its array buffers with tracemalloc in a separate
+domain, which is reported on its own as the live numpy buffer bytes. Pillow
+allocates image memory from its own block arena instead; its block counters
+come from PIL.Image.core.
+
+RSS deltas of requests that overlapped other requests include their
+allocations too, so `solo` counts only requests that ran alone.
+"""
+import gc
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image
+
+from procstats import memory_usage, process_age_seconds, rss_bytes
+
+logger = logging.getLogger(__name__)
+
+NUMPY_TRACEMALLOC_DOMAIN = getattr(np.lib, 'tracemalloc_domain', 389047)
+
+# Allocations made by tracemalloc and the import system are noise in growth reports
+SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+]
+
+
+def pil_arena_stats():
+    """Pillow block arena counters, with the bytes held in its free-block cache."""
+    try:
+        stats = dict(Image.core.get_stats())
+        block_size = Image.core.get_block_size()
+        stats.update(block_size=block_size, blocks_max=Image.core.get_blocks_max(),
+                     cached_bytes=stats.get('blocks_cached', 0) * block_size)
+        return stats
+    except AttributeError:
+        return {}
+
+
+def gc_stats():
+    return {
+        'counts': gc.get_count(),
+        'generations': gc.get_stats(),
+        'uncollectable': len(gc.garbage),
+        'frozen': gc.get_freeze_count(),
+    }
+
+
+def format_site(stat, key_type):
+    """JSON form of a tracemalloc Statistic or StatisticDiff."""
+    frames = [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback]
+    site = {'site': frames[0] if key_type == 'lineno' else frames, 'size_bytes': stat.size, 'count': stat.count}
+    if hasattr(stat, 'size_diff'):
+        site.update(size_diff_bytes=stat.size_diff, count_diff=stat.count_diff)
+    return site
+
+
+class MemoryMonitor:
+    def __init__(self, report_path=None, report_interval=300, tracemalloc_frames=0, top_sites=15, window=200,
+                 report_max_bytes=10 * 1024 * 1024):
+        self.report_path = report_path
+        self.report_max_bytes = report_max_bytes
+        self.report_interval = report_interval
+        self.tracemalloc_frames = tracemalloc_frames
+        self.top_sites = top_sites
+        self.window = window
+        self._key_type = 'traceback' if tracemalloc_frames > 1 else 'lineno'
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_started(self):
+        # Started lazily, and again after a fork, so a preloaded gunicorn master never
+        # traces allocations or runs the reporting thread on behalf of its workers
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._baseline_rss = rss_bytes()
+            self._in_flight = 0
+            self._recent = deque(maxlen=self.window)
+            self._totals = {}
+            self._first_snapshot = None
+            self._previous_snapshot = None
+            self._growth = {}
+            # Set last: other threads skip the lock once the pid matches
+            self._pid = os.getpid()
+            if self.tracemalloc_frames > 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(self.tracemalloc_frames)
+            if self.report_interval > 0:
+                threading.Thread(target=self._report_loop, name='memory-report', daemon=True).start()
+
+    @contextmanager
+    def track(self, label):
+        """Record the RSS change across the wrapped block under label."""
+        self._ensure_started()
+        with self._lock:
+            self._in_flight += 1
+            overlapped = self._in_flight > 1
+        before = rss_bytes()
+        try:
+            yield
+        finally:
+            after = rss_bytes()
+            with self._lock:
+                overlapped = overlapped or self._in_flight > 1
+                self._in_flight -= 1
+                if before is not None and after is not None:
+                    self._record(label, after - before, after, overlapped)
+
+    def _record(self, label, delta, rss, overlapped):
+        totals = self._totals.setdefault(label, {
+            'requests': 0, 'delta_bytes': 0, 'max_delta_bytes': 0, 'solo': 0, 'solo_delta_bytes': 0
+        })
+        totals['requests'] += 1
+        totals['delta_bytes'] += delta
+        totals['max_delta_bytes'] = max(totals['max_delta_bytes'], delta)
+        if not overlapped:
+            totals['solo'] += 1
+            totals['solo_delta_bytes'] += delta
+        self._recent.append({
+            'label': label, 'at': round(time.time(), 1), 'delta_bytes': delta, 'rss_bytes': rss,
+            'overlapped': overlapped
+        })
+
+    def _report_loop(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.report_interval)
+            try:
+                self.write_report(self.report(snapshot=True))
+            except Exception as e:
+                logger.error(f"Memory report failed: {e}")
+
+    def snapshot(self):
+        """Take a tracemalloc snapshot and diff it against the previous and the first one."""
+        if not tracemalloc.is_tracing():
+            return
+        snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+        numpy_snapshot = snapshot.filter_traces([tracemalloc.DomainFilter(True, NUMPY_TRACEMALLOC_DOMAIN)])
+        python_snapshot = snapshot.filter_traces([tracemalloc.DomainFilter(False, NUMPY_TRACEMALLOC_DOMAIN)])
+        with self._lock:
+            first, previous = self._first_snapshot, self._previous_snapshot
+            if first is None:
+                first = self._first_snapshot = python_snapshot
+            self._previous_snapshot = python_snapshot
+        growth = {
+            'since_previous': self._top_growth(python_snapshot, previous or python_snapshot),
+            'since_first': self._top_growth(python_snapshot, first),
+            'numpy_sites': [
+                format_site(stat, self._key_type)
+                for stat in numpy_snapshot.statistics(self._key_type)[:self.top_sites]
+            ],
+            'numpy_buffer_bytes': sum(trace.size for trace in numpy_snapshot.traces),
+            'numpy_buffers': len(numpy_snapshot.traces),
+            'taken_at': round(time.time(), 1),
+        }
+        with self._lock:
+            self._growth = growth
+
+    def _top_growth(self, snapshot, reference):
+        stats = [stat for stat in snapshot.compare_to(reference, self._key_type) if stat.size_diff > 0]
+        return [format_site(stat, self._key_type) for stat in stats[:self.top_sites]]
+
+    def report(self, snapshot=False):
+        """Current memory, per-label request RSS deltas, GC and Pillow stats and the last snapshot diff."""
+        self._ensure_started()
+        if snapshot:
+            self.snapshot()
+        rss = rss_bytes()
+        with self._lock:
+            requests = {label: dict(totals) for label, totals in self._totals.items()}
+            recent = list(self._recent)[-20:]
+            growth = dict(self._growth)
+            baseline = self._baseline_rss
+        for totals in requests.values():
+            totals['mean_delta_bytes'] = round(totals['delta_bytes'] / totals['requests'])
+        report = {
+            'pid': os.getpid(),
+            'at': round(time.time(), 1),
+            'uptime_seconds': process_age_seconds(),
+            'memory': memory_usage(),
+            'rss_growth_bytes': rss - baseline if rss is not None and baseline is not None else None,
+            'requests': requests,
+            'recent': recent,
+            'gc': gc_stats(),
+            'pil': pil_arena_stats(),
+            'tracemalloc': {'enabled': tracemalloc.is_tracing()},
+        }
+        if tracemalloc.is_tracing():
+            traced, peak = tracemalloc.get_traced_memory()
+            report['tracemalloc'].update(traced_bytes=traced, peak_bytes=peak,
+                                         overhead_bytes=tracemalloc.get_tracemalloc_memory(), **growth)
+        return report
+
+    def write_report(self, report):
+        """Append report as one JSON line; a single O_APPEND write keeps workers' lines whole."""
+        if not self.report_path:
+            return
+        line = (json.dumps(report, default=str) + '\n').encode('utf-8')
+        try:
+            if os.path.getsize(self.report_path) + len(line) > self.report_max_bytes:
+                # Workers racing to rotate can drop the older file; these are diagnostics only
+                os.replace(self.report_path, f'{self.report_path}.1')
+        except FileNotFoundError:
+            pass
+        fd = os.open(self.report_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
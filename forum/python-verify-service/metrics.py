@@ -0,0 +1,55 @@
+"""Prometheus metrics for the verification service.
+
+With PROMETHEUS_MULTIPROC_DIR set (see gunicorn.conf.py), every gunicorn worker
+writes its samples to memory-mapped files in that directory and /metrics
+aggregates all workers; without it only the current process is reported.
+"""
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+# Unlabelled metrics open their files as soon as they are created, including when app.py
+# is imported outside gunicorn (verify_batch.py, python app.py)
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+STAGE_SECONDS = Histogram(
+    'verify_stage_seconds', 'Wall-clock duration of each verification stage', ['stage'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+)
+DOWNLOAD_BYTES = Counter('verify_download_bytes_total', 'Image bytes downloaded from storage')
+IMAGE_LONGEST_SIDE = Histogram(
+    'verify_image_longest_side_pixels', 'Longest image side as uploaded and after decode/resize', ['phase'],
+    buckets=(256, 512, 768, 1024, 1536, 2048, 3072, 4096, 6000, 8192)
+)
+CACHE_LOOKUPS = Counter('verify_cache_lookups_total', 'Stage cache lookups by outcome', ['cache', 'result'])
+UPSTREAM_ERRORS = Counter(
+    'verify_upstream_errors_total', 'Failed, slow or circuit-rejected upstream calls', ['dependency', 'kind']
+)
+IN_FLIGHT = Gauge(
+    'verify_in_flight_requests', 'Verifications currently running', ['endpoint'], multiprocess_mode='livesum'
+)
+FACE_MATCH_SCORE = Histogram(
+    'verify_face_match_score', 'Face match scores of compared selfie/ID pairs',
+    buckets=(0.1, 0.2, 0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6, 0.7, 0.8, 0.9, 1.0)
+)
+# Set by each gunicorn worker once warmed up; memory is refreshed on every scrape and /ready probe
+WORKER_START_SECONDS = Gauge(
+    'verify_worker_start_seconds', 'Seconds from worker fork to ready, including warm-up', multiprocess_mode='liveall'
+)
+WORKER_MEMORY_BYTES = Gauge(
+    'verify_worker_memory_bytes', 'Worker memory from smaps_rollup (uss = not shared with any other process)',
+    ['kind'], multiprocess_mode='liveall'
+)
+
+
+def render():
+    """Return (body, content_type) for a /metrics scrape."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,117 @@
+"""Offline Canadian postal code -> centroid lookup.
+
+The index is a sorted numpy structured array saved as .npy and loaded with
+mmap_mode='r', so every gunicorn worker shares the same page-cache copy.
+It holds one row per full postal code ('H4P0A9') plus one row per FSA
+('H4P') whose coordinates are the mean of that FSA's postal codes.
+
+Rebuild it from a CSV drop with:
+
+    python postal_index.py build postal_codes.csv postal_index.npy
+"""
+import csv
+import logging
+import sys
+from collections import defaultdict
+
+import numpy as np
+
+from addresses import normalize_postal_code
+
+logger = logging.getLogger(__name__)
+
+INDEX_DTYPE = np.dtype([('code', 'S6'), ('lat', '<f4'), ('lng', '<f4')])
+
+CODE_COLUMNS = ('postal_code', 'postalcode', 'postal', 'code')
+LAT_COLUMNS = ('latitude', 'lat')
+LNG_COLUMNS = ('longitude', 'lng', 'lon', 'long')
+
+
+def _find_column(fieldnames, candidates):
+    lookup = {name.strip().lower(): name for name in fieldnames}
+    for candidate in candidates:
+        if candidate in lookup:
+            return lookup[candidate]
+    raise ValueError(f"CSV is missing a column named one of {candidates}")
+
+
+def build_index(csv_path, output_path):
+    """Build the .npy index from a CSV with postal code, latitude and longitude columns."""
+    coords = {}
+    with open(csv_path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        code_col = _find_column(reader.fieldnames, CODE_COLUMNS)
+        lat_col = _find_column(reader.fieldnames, LAT_COLUMNS)
+        lng_col = _find_column(reader.fieldnames, LNG_COLUMNS)
+        for row in reader:
+            postal_code = normalize_postal_code(row[code_col])
+            try:
+                lat, lng = float(row[lat_col]), float(row[lng_col])
+            except (TypeError, ValueError):
+                continue
+            if postal_code:
+                coords[postal_code.replace(' ', '')] = (lat, lng)
+
+    fsa_coords = defaultdict(list)
+    for code, coord in coords.items():
+        fsa_coords[code[:3]].append(coord)
+    for fsa, points in fsa_coords.items():
+        coords[fsa] = tuple(np.mean(np.asarray(points), axis=0))
+
+    index = np.zeros(len(coords), dtype=INDEX_DTYPE)
+    for i, code in enumerate(sorted(coords)):
+        index[i] = (code.encode('ascii'), *coords[code])
+    np.save(output_path, index)
+    logger.info(f"Wrote {len(index)} entries ({len(fsa_coords)} FSAs) to {output_path}")
+    return len(index)
+
+
+class PostalIndex:
+    """Memory-mapped postal code centroid lookup with FSA fallback."""
+
+    def __init__(self, index):
+        self._index = index
+        self._codes = index['code']
+
+    @classmethod
+    def load(cls, path):
+        return cls(np.load(path, mmap_mode='r'))
+
+    def __len__(self):
+        return len(self._index)
+
+    def _find(self, code):
+        key = code.encode('ascii')
+        position = int(np.searchsorted(self._codes, key))
+        if position < len(self._codes) and self._codes[position] == key:
+            entry = self._index[position]
+            return {'lat': round(float(entry['lat']), 6), 'lng': round(float(entry['lng']), 6)}
+        return None
+
+    def lookup(self, postal_code):
+        """Return (coord, precision) with precision 'postal_code' or 'fsa', or (None, None)."""
+        normalized = normalize_postal_code(postal_code)
+        if normalized:
+            code = normalized.replace(' ', '')
+            coord = self._find(code)
+            if coord:
+                return coord, 'postal_code'
+            fsa = code[:3]
+        else:
+            # A bare FSA such as 'H4P' is still useful for the fallback
+            fsa = (postal_code or '').replace(' ', '').upper()[:3]
+            if len(fsa) != 3 or not (fsa[0].isalpha() and fsa[1].isdigit() and fsa[2].isalpha()):
+                return None, None
+
+        coord = self._find(fsa)
+        if coord:
+            return coord, 'fsa'
+        return None, None
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 4 or sys.argv[1] != 'build':
+        print("Usage: python postal_index.py build <postal_codes.csv> <postal_index.npy>")
+        sys.exit(1)
+    build_index(sys.argv[2], sys.argv[3])
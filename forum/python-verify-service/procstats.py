@@ -0,0 +1,56 @@
+"""Memory and uptime of the current process, read from /proc.
+
+Both helpers return empty/None values where /proc is unavailable (e.g. local
+development on macOS) instead of raising.
+"""
+import os
+
+SMAPS_FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+
+
+def memory_usage(pid='self'):
+    """Return {'rss', 'pss', 'uss', 'shared'} in bytes from /proc/<pid>/smaps_rollup.
+
+    uss (Private_Clean + Private_Dirty) is the memory only this process holds, i.e.
+    what exiting it would free. Pages still shared copy-on-write with the gunicorn
+    master or other workers are counted in shared, and split between the sharers in pss.
+    """
+    values = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                field, _, rest = line.partition(':')
+                if field in SMAPS_FIELDS:
+                    values[field] = int(rest.split()[0]) * 1024
+    except (OSError, ValueError):
+        return {}
+    if not values:
+        return {}
+    return {
+        'rss': values.get('Rss', 0),
+        'pss': values.get('Pss', 0),
+        'uss': values.get('Private_Clean', 0) + values.get('Private_Dirty', 0),
+        'shared': values.get('Shared_Clean', 0) + values.get('Shared_Dirty', 0),
+    }
+
+
+def rss_bytes(pid='self'):
+    """Resident set size from /proc/<pid>/statm, cheap enough to read on every request."""
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def process_age_seconds(pid='self'):
+    """Seconds since the process was forked or started, or None without /proc."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # starttime is field 22; the command name before it may contain spaces
+            fields = f.read().rpartition(')')[2].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return round(uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK'), 2)
+    except (OSError, ValueError, IndexError):
+        return None
@@ -0,0 +1,22 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """Blocking limiter that spaces calls evenly at up to per_minute calls per minute."""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait until the next call slot, then claim it."""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_at)
+            self._next_at = start + self.interval
+        if start > now:
+            time.sleep(start - now)
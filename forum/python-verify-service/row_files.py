@@ -0,0 +1,41 @@
+"""Paired append-only row files behind face_index and image_hash.
+
+Each index keeps fixed-width data rows in one file and fixed-width record ids
+in another. Every gunicorn worker appends to both under an exclusive flock on
+the data file and memory-maps them read-only for searching.
+"""
+import fcntl
+import os
+
+
+def create_files(*paths):
+    """Create the files (and their directories) if they do not exist yet."""
+    for path in paths:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        open(path, 'ab').close()
+
+
+def encode_id(record_id, width):
+    """UTF-8 record id truncated and NUL-padded to width bytes."""
+    return str(record_id).encode('utf-8')[:width].ljust(width, b'\0')
+
+
+def append_row(data_path, ids_path, data_row, id_row):
+    """Append one data row and its fixed-width id, keeping both files row-aligned."""
+    data_width, id_width = len(data_row), len(id_row)
+    with open(data_path, 'r+b') as data_file, open(ids_path, 'r+b') as ids_file:
+        fcntl.flock(data_file, fcntl.LOCK_EX)
+        try:
+            # Drop a half-written row left by a crashed writer so both files stay aligned
+            rows = min(os.fstat(data_file.fileno()).st_size // data_width,
+                       os.fstat(ids_file.fileno()).st_size // id_width)
+            data_file.truncate(rows * data_width)
+            ids_file.truncate(rows * id_width)
+            data_file.seek(0, os.SEEK_END)
+            ids_file.seek(0, os.SEEK_END)
+            data_file.write(data_row)
+            ids_file.write(id_row)
+            data_file.flush()
+            ids_file.flush()
+        finally:
+            fcntl.flock(data_file, fcntl.LOCK_UN)
@@ -0,0 +1,63 @@
+"""Re-run stored verification attempts in bulk, e.g. after changing the threshold or prompts.
+
+Reads a JSON Lines file of /verify payloads (selfie_url, id_photo_url, id_type,
+optional manual_address and an id to match results back to attempts) and writes
+one NDJSON result per item, in completion order, using the same pipeline as
+POST /verify/batch but in-process:
+
+    python verify_batch.py attempts.jsonl results.ndjson --concurrency 8
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+from ratelimit import RateLimiter
+
+
+def read_items(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('input', help='JSON Lines file of verification payloads')
+    parser.add_argument('output', nargs='?', help='NDJSON output file (default: stdout)')
+    parser.add_argument('--concurrency', type=int, help='Items verified at once')
+    parser.add_argument('--prefetch', type=int, help='Upcoming items whose images are downloaded ahead')
+    parser.add_argument('--openai-per-minute', type=int, help='Maximum items started per minute, 0 for no limit')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    # This process only runs the batch; queued /verify/jobs jobs are left to the service
+    os.environ['VERIFY_JOB_WORKERS_ENABLED'] = 'false'
+    # Imported here so --help works without loading models or API clients
+    import app
+
+    items = read_items(args.input)
+    options = {
+        'concurrency': args.concurrency or app.BATCH_CONCURRENCY,
+        'prefetch': args.prefetch if args.prefetch is not None else app.BATCH_PREFETCH,
+        'limiter': RateLimiter(args.openai_per_minute) if args.openai_per_minute is not None else app.batch_limiter,
+        # No live traffic shares this process, so only --concurrency limits the items in flight
+        'admission_limit': None,
+    }
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    start = time.perf_counter()
+    try:
+        for count, result in enumerate(app.run_batch(items, **options), 1):
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+            if count % 100 == 0:
+                logging.info(f"{count}/{len(items)} items verified in {time.perf_counter() - start:.0f}s")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    logging.info(f"Verified {len(items)} items in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Per-worker warm-up behind the /ready probe.
+
+/health only says the process answers HTTP. /ready returns 200 once every
+warm-up step has run in this process, so a load balancer or rolling deploy
+does not route traffic to a worker that is still loading models or starting
+its face inference pool.
+"""
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from procstats import memory_usage, process_age_seconds
+
+logger = logging.getLogger(__name__)
+
+WARM_UP_IMAGE_SIDE = 320
+
+
+def synthetic_image(side=WARM_UP_IMAGE_SIDE):
+    """Deterministic RGB noise image for warm-up inference."""
+    return np.random.default_rng(0).integers(0, 256, (side, side, 3), dtype=np.uint8)
+
+
+class WorkerStartup:
+    """Runs named warm-up steps once per process and records how long startup took.
+
+    start() may be called again in a forked child, which resets the state copied
+    from the parent and warms up the child on its own. on_ready, if given, is
+    called with status() once the process is ready.
+    """
+
+    def __init__(self, steps, on_ready=None):
+        self.steps = steps
+        self.on_ready = on_ready or (lambda status: None)
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.started = time.monotonic()
+        self.step_ms = {}
+        self.error = None
+        self.start_seconds = None
+        self.memory_at_ready = {}
+        self._ready = threading.Event()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def start(self):
+        """Run the warm-up steps in a background thread of the current process."""
+        if self.pid != os.getpid():
+            self._reset()
+        threading.Thread(target=self._run, name='warm-up', daemon=True).start()
+
+    def _run(self):
+        for name, fn in self.steps:
+            step_started = time.monotonic()
+            try:
+                fn()
+            except Exception as e:
+                self.error = f"{name}: {e}"
+                logger.error(f"Warm-up step {name} failed, worker {self.pid} stays unready: {e}")
+                return
+            self.step_ms[name] = round((time.monotonic() - step_started) * 1000, 1)
+
+        # Time since fork (or process start), so a preloaded worker is not credited
+        # with the imports the gunicorn master already did
+        age = process_age_seconds()
+        self.start_seconds = age if age is not None else round(time.monotonic() - self.started, 2)
+        self.memory_at_ready = memory_usage()
+        self._ready.set()
+        uss_mb = self.memory_at_ready.get('uss', 0) / (1024 * 1024)
+        logger.info(f"Worker {self.pid} ready after {self.start_seconds}s (warm-up {self.step_ms}, USS {uss_mb:.1f}MB)")
+        self.on_ready(self.status())
+
+    def status(self):
+        return {
+            'ready': self.ready,
+            'pid': self.pid,
+            'start_seconds': self.start_seconds,
+            'warm_up_ms': dict(self.step_ms),
+            'error': self.error,
+            'memory_at_ready': self.memory_at_ready,
+            'memory': memory_usage(),
+        }
@@ -1,6 +1,42 @@
 import { NextRequest, NextResponse } from 'next/server';
 import { createServerSupabaseClient } from '@/lib/supabaseServer';
 
+// The verification service sheds load with 429 (admission control), 503 (face matching
+// at capacity or image storage unavailable) and 504 (deadline hit while downloading),
+// each meaning "try again shortly".
+const RETRYABLE_STATUSES = new Set([429, 503, 504]);
+const MAX_VERIFY_ATTEMPTS = 3;
+const MAX_RETRY_DELAY_MS = 5000;
+
+function retryDelayMs(response: Response): number {
+  const retryAfter = Number(response.headers.get('Retry-After'));
+  const delay = Number.isFinite(retryAfter) && retryAfter > 0 ? retryAfter * 1000 : 1000;
+  return Math.min(delay, MAX_RETRY_DELAY_MS);
+}
+
+// Calls the service, waiting out Retry-After (capped) between a bounded number of attempts
+async function callVerifyService(body: string): Promise<Response> {
+  for (let attempt = 1; ; attempt++) {
+    const response = await fetch(
+      process.env.RAILWAY_VERIFY_SERVICE_URL || 'http://localhost:8080/verify',
+      {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json; charset=utf-8',
+        },
+        body,
+      }
+    );
+    if (!RETRYABLE_STATUSES.has(response.status) || attempt >= MAX_VERIFY_ATTEMPTS) {
+      return response;
+    }
+    const delay = retryDelayMs(response);
+    console.warn(`Verification service busy (${response.status}), retrying in ${delay}ms`);
+    await response.body?.cancel();
+    await new Promise((resolve) => setTimeout(resolve, delay));
+  }
+}
+
 export async function POST(request: NextRequest) {
   try {
     const formData = await request.formData();
@@ -101,22 +137,34 @@ export async function POST(request: NextRequest) {
     }
 
     // Call Railway Python verification service
-    const verificationResponse = await fetch(
-      process.env.RAILWAY_VERIFY_SERVICE_URL || 'http://localhost:8080/verify',
-      {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json; charset=utf-8',
-        },
-        body: JSON.stringify({
-          selfie_url: selfieUrl,
-          id_photo_url: idPhotoUrl,
-          id_type: idType,
-          manual_address: manualAddress,
-        }),
-      }
+    const verificationResponse = await callVerifyService(
+      JSON.stringify({
+        selfie_url: selfieUrl,
+        id_photo_url: idPhotoUrl,
+        id_type: idType,
+        manual_address: manualAddress,
+        // Lets the service tell this user's own earlier attempts apart from other accounts
+        subject_id: email.trim().toLowerCase(),
+      })
     );
 
+    if (RETRYABLE_STATUSES.has(verificationResponse.status)) {
+      // Still busy after retrying: the attempt stays pending and the user can retry,
+      // rather than recording a failed verification for load the service shed
+      const retryAfterSeconds = Math.ceil(retryDelayMs(verificationResponse) / 1000);
+      console.warn(`Verification service still busy (${verificationResponse.status}) after ${MAX_VERIFY_ATTEMPTS} attempts`);
+      return NextResponse.json(
+        {
+          error: 'Verification service is busy',
+          reason: 'The verification service is busy. Please try again in a few seconds.',
+          retryable: true,
+          retryAfter: retryAfterSeconds,
+          attemptId: attemptData.id,
+        },
+        { status: 503, headers: { 'Retry-After': String(retryAfterSeconds) } }
+      );
+    }
+
     if (!verificationResponse.ok) {
       const errorText = await verificationResponse.text();
       console.error('Python verification error:', errorText);
@@ -147,7 +195,12 @@ export async function POST(request: NextRequest) {
       verified_at?: string;
     } = {
       face_match_score: verificationResult.face_match_score,
-      ocr_data: verificationResult.ocr_data,
+      // Other accounts with a similar verified face or ID photo are kept with the attempt for review
+      ocr_data: {
+        ...verificationResult.ocr_data,
+        face_index_matches: verificationResult.face_index_matches ?? null,
+        id_photo_duplicates: verificationResult.id_photo_duplicates ?? null,
+      },
       status: verificationResult.verified ? 'verified' : 'failed',
       failure_reason: verificationResult.verified ? null : verificationResult.reason,
     };
@@ -171,6 +224,8 @@ export async function POST(request: NextRequest) {
       faceMatchScore: verificationResult.face_match_score,
       reason: verificationResult.reason,
       ocr_data: verificationResult.ocr_data,
+      faceIndexMatches: verificationResult.face_index_matches ?? null,
+      idPhotoDuplicates: verificationResult.id_photo_duplicates ?? null,
     });
 
   } catch (error) {